@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# URL 查询缓存最多保留的条目数，超出后删除最早写入的
+URL_CACHE_SIZE = int(os.environ.get('URL_CACHE_SIZE', 2000))
+# 其他进程持有写锁时最多等待的时间（毫秒）
+BUSY_TIMEOUT = 5000
+
+# 按版本号排列的建表/迁移语句，PRAGMA user_version 记录已执行到的版本
+MIGRATIONS = [
+    # 1: 视频文件、片段和 URL 查询缓存
+    """
+    CREATE TABLE IF NOT EXISTS videos (
+        key TEXT PRIMARY KEY,
+        video_id TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        quality TEXT NOT NULL,
+        kind TEXT NOT NULL DEFAULT 'video',
+        title TEXT,
+        filename TEXT NOT NULL,
+        size INTEGER,
+        created REAL
+    );
+    CREATE INDEX IF NOT EXISTS videos_by_id ON videos (video_id, page);
+
+    CREATE TABLE IF NOT EXISTS segments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_key TEXT NOT NULL,
+        path TEXT NOT NULL UNIQUE,
+        created REAL
+    );
+    CREATE INDEX IF NOT EXISTS segments_by_video ON segments (video_key, id);
+
+    CREATE TABLE IF NOT EXISTS url_cache (
+        hash TEXT PRIMARY KEY,
+        video_key TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created REAL
+    );
+    CREATE INDEX IF NOT EXISTS url_cache_by_video ON url_cache (video_key);
+    CREATE INDEX IF NOT EXISTS url_cache_by_created ON url_cache (created);
+    """,
+    # 2: 片段的时间范围、大小、编码参数和剪辑缓存键
+    """
+    ALTER TABLE segments ADD COLUMN start_time REAL;
+    ALTER TABLE segments ADD COLUMN end_time REAL;
+    ALTER TABLE segments ADD COLUMN size INTEGER;
+    ALTER TABLE segments ADD COLUMN settings TEXT;
+    ALTER TABLE segments ADD COLUMN cache_key TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS segments_by_cache_key ON segments (cache_key);
+    """,
+    # 3: 正在运行的任务和打开的会话对文件的占用，被占用的文件不会被容量管理清理
+    """
+    CREATE TABLE IF NOT EXISTS pins (
+        owner TEXT PRIMARY KEY,
+        target TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS pins_by_expires ON pins (expires);
+    """,
+    # 4: 后台任务的状态和进度，任何工作进程都能查询其他进程接受的任务
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        stage TEXT,
+        progress TEXT NOT NULL,
+        message TEXT,
+        result TEXT,
+        error TEXT,
+        created REAL,
+        updated REAL,
+        version INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_by_updated ON jobs (status, updated);
+    """,
+]
+
+# 版本 1 的片段只有路径，升级时从文件名中补出时间范围
+LEGACY_SEGMENT_NAME = re.compile(r'_(\d+(?:\.\d+)?)-(\d+(?:\.\d+)?)(?:_\w+)?\.mp4$')
+
+
+def _backfill_segments(conn):
+    rows = conn.execute('SELECT id, path FROM segments WHERE start_time IS NULL').fetchall()
+    for row in rows:
+        match = LEGACY_SEGMENT_NAME.search(row['path'])
+        if not match:
+            conn.execute('DELETE FROM segments WHERE id = ?', (row['id'],))
+            continue
+        size = os.path.getsize(row['path']) if os.path.exists(row['path']) else None
+        conn.execute('UPDATE segments SET start_time = ?, end_time = ?, size = ? WHERE id = ?',
+                     (float(match.group(1)), float(match.group(2)), size, row['id']))
+
+
+# 执行完某个版本的语句后需要运行的数据迁移
+MIGRATION_HOOKS = {2: _backfill_segments}
+
+VIDEO_COLUMNS = ('key', 'video_id', 'page', 'quality', 'kind', 'title', 'filename', 'size', 'created')
+
+
+class Catalog:
+    """
+    下载目录的 SQLite 索引：视频文件、剪辑片段、URL 查询缓存、文件占用和后台任务状态。
+    使用 WAL 模式，多个工作进程可以同时读、依次写，共享同一份状态；
+    每个线程使用自己的连接。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._migrate()
+
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT / 1000)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+            self.local.conn = conn
+        return conn
+
+    def _migrate(self):
+        conn = self.conn
+        # BEGIN IMMEDIATE 取得写锁，多个进程同时启动时只有一个执行迁移
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in filter(str.strip, script.split(';')):
+                    conn.execute(statement)
+                if number in MIGRATION_HOOKS:
+                    MIGRATION_HOOKS[number](conn)
+                conn.execute(f'PRAGMA user_version={number}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    # 视频文件
+
+    def get_video(self, key):
+        row = self.conn.execute('SELECT * FROM videos WHERE key = ?', (key,)).fetchone()
+        return dict(row) if row else None
+
+    def find_videos(self, video_id, page):
+        rows = self.conn.execute('SELECT * FROM videos WHERE video_id = ? AND page = ?', (video_id, page))
+        return [dict(row) for row in rows]
+
+    def put_video(self, record):
+        with self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO videos ({', '.join(VIDEO_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(VIDEO_COLUMNS))})",
+                [record.get(column) for column in VIDEO_COLUMNS])
+
+    def remove_video(self, key):
+        with self.conn:
+            return self.conn.execute('DELETE FROM videos WHERE key = ?', (key,)).rowcount > 0
+
+    def video_files(self):
+        """所有视频记录的 文件名 -> 键"""
+        return {row['filename']: row['key'] for row in self.conn.execute('SELECT key, filename FROM videos')}
+
+    # 剪辑片段
+
+    def add_segment(self, video_key, path, start, end, settings=None, cache_key=None):
+        """
+        登记剪辑出的片段，同一路径再次登记时更新
+        :param settings: 编码参数，如 {'mode': 'smart', 'preset': 'veryfast', 'crf': 18}
+        :param cache_key: 剪辑缓存键，见 ClipCache.key
+        """
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        with self.conn:
+            if cache_key is not None:
+                # 缓存键唯一，同一剪辑改存到新路径时旧记录不再作为缓存
+                self.conn.execute('UPDATE segments SET cache_key = NULL WHERE cache_key = ? AND path != ?',
+                                  (cache_key, path))
+            self.conn.execute(
+                'INSERT INTO segments (video_key, path, start_time, end_time, size, settings, cache_key, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (path) DO UPDATE SET video_key = excluded.video_key, start_time = excluded.start_time, '
+                'end_time = excluded.end_time, size = excluded.size, settings = excluded.settings, '
+                'cache_key = excluded.cache_key, created = excluded.created',
+                (video_key, path, float(start), float(end), size,
+                 json.dumps(settings) if settings is not None else None, cache_key, time.time()))
+
+    @staticmethod
+    def _segment(row):
+        segment = dict(row)
+        segment['settings'] = json.loads(segment['settings']) if segment['settings'] else None
+        return segment
+
+    def segments(self, video_key, offset=0, limit=None):
+        """按登记顺序列出视频的片段，limit 为 None 时返回全部"""
+        rows = self.conn.execute('SELECT * FROM segments WHERE video_key = ? ORDER BY id LIMIT ? OFFSET ?',
+                                 (video_key, -1 if limit is None else limit, offset))
+        return [self._segment(row) for row in rows]
+
+    def count_segments(self, video_key):
+        return self.conn.execute('SELECT COUNT(*) FROM segments WHERE video_key = ?', (video_key,)).fetchone()[0]
+
+    def get_segment(self, segment_id):
+        row = self.conn.execute('SELECT * FROM segments WHERE id = ?', (segment_id,)).fetchone()
+        return self._segment(row) if row else None
+
+    def segment_by_path(self, path):
+        row = self.conn.execute('SELECT * FROM segments WHERE path = ?', (path,)).fetchone()
+        return self._segment(row) if row else None
+
+    def segment_by_cache_key(self, cache_key):
+        row = self.conn.execute('SELECT * FROM segments WHERE cache_key = ?', (cache_key,)).fetchone()
+        return self._segment(row) if row else None
+
+    def count_cached_segments(self):
+        return self.conn.execute('SELECT COUNT(*) FROM segments WHERE cache_key IS NOT NULL').fetchone()[0]
+
+    def has_segments(self, video_key):
+        return self.conn.execute('SELECT 1 FROM segments WHERE video_key = ? LIMIT 1', (video_key,)).fetchone() is not None
+
+    def remove_segments(self, video_key):
+        with self.conn:
+            self.conn.execute('DELETE FROM segments WHERE video_key = ?', (video_key,))
+
+    def remove_segment(self, path):
+        with self.conn:
+            self.conn.execute('DELETE FROM segments WHERE path = ?', (path,))
+
+    def segment_files(self):
+        """所有片段的 路径 -> 视频键"""
+        return {row['path']: row['video_key'] for row in self.conn.execute('SELECT path, video_key FROM segments')}
+
+    # URL 查询缓存
+
+    def get_url(self, url_hash):
+        row = self.conn.execute('SELECT response FROM url_cache WHERE hash = ?', (url_hash,)).fetchone()
+        return json.loads(row['response']) if row else None
+
+    def put_url(self, url_hash, video_key, response):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO url_cache (hash, video_key, response, created) VALUES (?, ?, ?, ?)',
+                              (url_hash, video_key, json.dumps(response, ensure_ascii=False), time.time()))
+            self.conn.execute(
+                'DELETE FROM url_cache WHERE hash IN '
+                '(SELECT hash FROM url_cache ORDER BY created DESC LIMIT -1 OFFSET ?)', (URL_CACHE_SIZE,))
+
+    def remove_urls(self, video_key):
+        with self.conn:
+            self.conn.execute('DELETE FROM url_cache WHERE video_key = ?', (video_key,))
+
+    # 文件占用
+
+    def pin(self, owner, target, expires):
+        """
+        登记占用，同一占用者再次登记时更新
+        :param target: 视频键（占用该视频及其片段）或文件路径
+        :param expires: 过期时间戳，占用者异常退出时到期自动失效
+        """
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO pins (owner, target, expires) VALUES (?, ?, ?)',
+                              (owner, target, expires))
+
+    def unpin(self, owner):
+        with self.conn:
+            self.conn.execute('DELETE FROM pins WHERE owner = ?', (owner,))
+
+    def pinned(self):
+        """清除过期占用，返回仍被占用的目标集合"""
+        with self.conn:
+            self.conn.execute('DELETE FROM pins WHERE expires < ?', (time.time(),))
+            return {row['target'] for row in self.conn.execute('SELECT DISTINCT target FROM pins')}
+
+    # 后台任务
+
+    def get_job(self, job_id):
+        """返回任务快照和版本号，progress、result 已解析"""
+        row = self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['progress'] = json.loads(job['progress'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def put_job(self, snapshot, version):
+        """
+        写入任务状态，同一任务再次写入时覆盖
+        :param snapshot: Job.snapshot() 的结果
+        """
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO jobs (id, kind, status, stage, progress, message, result, error, '
+                'created, updated, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (snapshot['job_id'], snapshot['kind'], snapshot['status'], snapshot['stage'],
+                 json.dumps(snapshot['progress']),
+                 snapshot['message'],
+                 json.dumps(snapshot['result'], ensure_ascii=False) if snapshot['result'] is not None else None,
+                 snapshot['error'], snapshot['created'], snapshot['updated'], version))
+
+    def trim_jobs(self, statuses, keep):
+        """只保留最近结束的 keep 个状态在 statuses 中的任务"""
+        marks = ', '.join('?' * len(statuses))
+        with self.conn:
+            self.conn.execute(
+                f'DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ({marks}) '
+                f'ORDER BY updated DESC LIMIT -1 OFFSET ?)', (*statuses, keep))
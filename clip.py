@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# 根据操作系统选择 ffmpeg 命令
+FFMPEG_CMD = 'ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg'
+
+# 剪辑模式：smart 只重编码首尾不完整的 GOP，中间直接复制；exact 整段重编码
+CLIP_MODE = os.environ.get('CLIP_MODE', 'smart')
+CLIP_MODES = ('smart', 'exact')
+# 重编码部分的 x264/x265 参数
+CLIP_PRESET = os.environ.get('CLIP_PRESET', 'veryfast')
+CLIP_CRF = int(os.environ.get('CLIP_CRF', 18))
+
+# 批量剪辑时，相邻片段间隔超过该值（秒）就分成两遍解码，跳过间隔比解码它更快
+CLIP_BATCH_MAX_GAP = float(os.environ.get('CLIP_BATCH_MAX_GAP', 10))
+
+# 剪辑点与关键帧相差不超过该值（秒）时视为正好落在关键帧上
+KEYFRAME_TOLERANCE = 0.001
+
+# 源视频编码 -> (重编码首尾时使用的编码器, 把参数集写入码流的比特流过滤器)，其他编码只能整段重编码
+ENCODERS = {
+    'h264': ('libx264', 'h264_mp4toannexb'),
+    'hevc': ('libx265', 'hevc_mp4toannexb'),
+}
+
+VIDEO_STREAM = re.compile(r'Stream #0:\d+.*?: Video: (\w+)(?: \(([^)]*)\))?[^,]*, (\w+)')
+AUDIO_STREAM = re.compile(r'Stream #0:\d+.*?: Audio: (\w+)')
+SHOWINFO_PTS = re.compile(r'\bpts_time:\s*(-?[\d.]+)')
+PROGRESS_TIME = re.compile(r'^out_time_(?:us|ms)=(\d+)$')
+FRAMECRC_TIMEBASE = re.compile(r'^#tb 0: (\d+)/(\d+)', re.M)
+
+
+def _run(cmd, duration=None, progress=None):
+    """
+    执行 ffmpeg，按 -progress 输出的已编码时长换算进度
+    :param duration: 输出时长（秒），用于计算百分比
+    :param progress: 进度回调 progress(百分比)
+    """
+    if not progress or not duration:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return
+
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        for line in process.stdout:
+            match = PROGRESS_TIME.match(line.strip())
+            if match:
+                progress(min(int(match.group(1)) / 1e6 / duration * 100, 100))
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr.read())
+
+
+def probe(source, start, end):
+    """
+    读取源文件的编码信息和 [start, end] 内的关键帧时间。
+    只解码窗口内的关键帧（-skip_frame nokey），不需要 ffprobe。
+    :return: {'codec', 'profile', 'pix_fmt', 'audio_codec', 'keyframes'}
+    """
+    cmd = [
+        FFMPEG_CMD, '-hide_banner', '-copyts',
+        '-ss', f"{start:.3f}", '-to', f"{end:.3f}",
+        '-skip_frame', 'nokey',
+        '-i', source,
+        '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-'
+    ]
+    result = subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = result.stderr.decode('utf-8', errors='replace')
+    return dict(_parse_streams(log), keyframes=sorted(float(t) for t in SHOWINFO_PTS.findall(log)))
+
+
+def stream_info(source):
+    """只读取源文件的编码信息，不解码"""
+    result = subprocess.run([FFMPEG_CMD, '-hide_banner', '-i', source], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return _parse_streams(result.stderr.decode('utf-8', errors='replace'))
+
+
+def _parse_streams(log):
+    """从 ffmpeg 输出的流描述中解析视频编码、档次、像素格式和音频编码"""
+    video = VIDEO_STREAM.search(log)
+    audio = AUDIO_STREAM.search(log)
+    return {
+        'codec': video.group(1) if video else None,
+        'profile': video.group(2) if video else None,
+        'pix_fmt': video.group(3) if video else None,
+        'audio_codec': audio.group(1) if audio else None,
+    }
+
+
+def _window(source, start, end):
+    """
+    定位到 start 的输入参数和按 [start, end) 选帧的滤镜。
+    输出端的 -t 在 start 不落在帧边界上时从前一帧起算，会少最后一帧，与从关键帧开始的片段规则不一致，
+    所以输入只多读 1 秒作为余量，帧由 trim/atrim 按相对 start 的时间戳选取
+    :return: (输入参数, 视频滤镜, 音频滤镜)
+    """
+    duration = end - start
+    return (['-ss', f"{start:.3f}", '-t', f"{duration + 1:.3f}", '-i', source],
+            f"trim=end={duration:.3f}", f"atrim=end={duration:.3f}")
+
+
+def _covered(path):
+    """读取视频流各包的时间戳（不解码），返回 (最早显示时间, 最晚结束时间)，单位秒；没有帧时返回 None"""
+    result = subprocess.run([FFMPEG_CMD, '-i', path, '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    packets = [line.split(',') for line in result.stdout.splitlines() if line and not line.startswith('#')]
+    # 没有写入任何帧的 matroska 文件无法打开
+    if result.returncode != 0 or not packets:
+        return None
+    num, den = FRAMECRC_TIMEBASE.search(result.stdout).groups()
+    starts = [int(p[2]) for p in packets]
+    ends = [int(p[2]) + int(p[3]) for p in packets]
+    return min(starts) * int(num) / int(den), max(ends) * int(num) / int(den)
+
+
+def _encoder_args(info):
+    """重编码首尾时尽量与源流参数一致，拼接后解码器不必重新初始化"""
+    args = ['-c:v', ENCODERS[info['codec']][0], '-preset', CLIP_PRESET, '-crf', str(CLIP_CRF)]
+    if info['pix_fmt']:
+        args += ['-pix_fmt', info['pix_fmt']]
+    profile = (info['profile'] or '').lower().replace('constrained ', '').replace(' ', '')
+    if profile in ('baseline', 'main', 'high', 'main10'):
+        args += ['-profile:v', profile]
+    return args
+
+
+def _video_part(source, start, end, output, copy, info):
+    """
+    截取 [start, end) 的视频流，copy 时起止点都必须是关键帧。
+    每个关键帧前都写入参数集，重编码段与复制段的 SPS/PPS 不同也能连续解码。
+    :return: 是否截取成功；复制段没有正好覆盖 [start, end) 时返回 False
+    """
+    inputs, video_filter, _ = _window(source, start, end)
+    cmd = [FFMPEG_CMD, '-y'] + inputs + ['-map', '0:v:0', '-an']
+    if not copy:
+        cmd += ['-vf', video_filter, '-fps_mode', 'passthrough'] + _encoder_args(info)
+        cmd += ['-bsf:v', ENCODERS[info['codec']][1], '-f', 'matroska', output]
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return True
+
+    # 复制按包截断，-t 会带上解码时间在 end 之前、显示时间在 end 及之后的 B 帧引用帧，
+    # 与从 end 开始重编码的尾段重复、播放时回跳。改用 segment 在 end 处的关键帧切开，只保留第一段
+    segment_pattern = os.path.join(os.path.dirname(output), 'copy%d.mkv')
+    cmd += ['-c:v', 'copy', '-bsf:v', ENCODERS[info['codec']][1],
+            '-f', 'segment', '-segment_times', f"{end - start:.3f}", '-segment_format', 'matroska',
+            segment_pattern]
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    os.replace(segment_pattern % 0, output)
+
+    # 校验复制段正好覆盖 [start, end)：多一帧会与尾段重叠，少一帧会留下空隙，两者都会让帧数与 exact 不同
+    covered = _covered(output)
+    if not covered:
+        return False
+    first, last = covered
+    return abs(first) <= KEYFRAME_TOLERANCE * 2 and abs(last - (end - start)) <= KEYFRAME_TOLERANCE * 2
+
+
+def cut_exact(source, start, end, output, progress=None):
+    """整段重编码，帧精确，保留显示时间在 [start, end) 内的帧"""
+    inputs, video_filter, audio_filter = _window(source, start, end)
+    cmd = [FFMPEG_CMD, '-y'] + inputs + [
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', video_filter, '-af', audio_filter,
+        # 保留源帧时间戳，开始时间不在帧边界上时不会补一个重复帧
+        '-fps_mode', 'passthrough',
+        '-c:v', 'libx264', '-preset', CLIP_PRESET, '-crf', str(CLIP_CRF),
+        '-c:a', 'aac',
+        '-movflags', '+faststart',
+        '-f', 'mp4',
+        output
+    ]
+    _run(cmd, end - start, progress)
+
+
+def cut_smart(source, start, end, output, info, progress=None):
+    """
+    智能剪辑：[start, 第一个关键帧) 和 [最后一个关键帧, end) 重编码，
+    中间完整的 GOP 直接复制，三段经 concat 拼接后与音频一起封装为 mp4
+    :return: 是否按智能剪辑完成，窗口内没有可复制的 GOP 或复制段校验不通过时返回 False
+    """
+    inside = [k for k in info['keyframes'] if start - KEYFRAME_TOLERANCE <= k <= end + KEYFRAME_TOLERANCE]
+    if len(inside) < 2:
+        return False
+    first_key, last_key = inside[0], inside[-1]
+
+    parts = []
+    if first_key - start > KEYFRAME_TOLERANCE:
+        parts.append((start, first_key, False))
+    parts.append((first_key, last_key, True))
+    if end - last_key > KEYFRAME_TOLERANCE:
+        parts.append((last_key, end, False))
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        list_path = os.path.join(work_dir, 'parts.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for i, (part_start, part_end, copy) in enumerate(parts):
+                part_path = os.path.join(work_dir, f'part{i}.mkv')
+                if not _video_part(source, part_start, part_end, part_path, copy, info):
+                    return False
+                if not copy and not _covered(part_path):
+                    # start 与第一个关键帧相差不到一帧时首段没有帧
+                    continue
+                f.write(f"file '{part_path}'\n")
+                if progress:
+                    progress((i + 1) / (len(parts) + 1) * 100)
+
+        # 音频很轻，按精确时间截取；源已是 AAC 时直接复制
+        cmd = [
+            FFMPEG_CMD, '-y',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-ss', f"{start:.3f}", '-t', f"{end - start:.3f}", '-i', source,
+            '-map', '0:v:0', '-map', '1:a:0?',
+            '-c:v', 'copy',
+            '-c:a', 'copy' if info['audio_codec'] == 'aac' else 'aac',
+            '-movflags', '+faststart',
+            '-f', 'mp4',
+            output
+        ]
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def cut_clip(source, start, end, output, mode=None, progress=None):
+    """
+    从本地视频剪出 [start, end]，先写入临时文件，成功后再改名为输出文件
+    :param source: 源视频路径
+    :param start: 开始时间（秒）
+    :param end: 结束时间（秒）
+    :param output: 输出文件路径
+    :param mode: smart 或 exact，默认 CLIP_MODE；源编码不支持智能剪辑时自动改为 exact
+    :param progress: 进度回调 progress(百分比)
+    :return: 实际使用的剪辑模式
+    """
+    start, end = float(start), float(end)
+    if end <= start:
+        raise ValueError("结束时间必须大于开始时间")
+    mode = mode or CLIP_MODE
+    if mode not in CLIP_MODES:
+        raise ValueError(f"不支持的剪辑模式: {mode}，可选: {', '.join(CLIP_MODES)}")
+
+    tmp_output = output + '.cutting'
+    try:
+        if mode == 'smart':
+            info = probe(source, start, end)
+            if info['codec'] in ENCODERS and cut_smart(source, start, end, tmp_output, info, progress):
+                os.replace(tmp_output, output)
+                return 'smart'
+            mode = 'exact'
+        cut_exact(source, start, end, tmp_output, progress)
+        os.replace(tmp_output, output)
+        return mode
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+
+
+def group_ranges(ranges, max_gap=CLIP_BATCH_MAX_GAP):
+    """
+    按时间把片段分组，组内相邻片段的间隔不超过 max_gap，每组解码一遍
+    :return: 片段下标列表的列表
+    """
+    groups = []
+    group_end = None
+    for i in sorted(range(len(ranges)), key=lambda i: ranges[i][0]):
+        start, end = ranges[i]
+        if group_end is None or start - group_end > max_gap:
+            groups.append([])
+            group_end = end
+        groups[-1].append(i)
+        group_end = max(group_end, end)
+    return groups
+
+
+def _scaled_progress(progress, base, span, total):
+    """各组进度按覆盖时长折算到整体：组内 percent% 对应整体的 (base + percent% * span) / total"""
+    return lambda percent: progress((base + percent / 100 * span) / total * 100)
+
+
+def cut_many(source, ranges, outputs, progress=None):
+    """
+    批量导出多个片段。时间上相近的片段只解码一遍：输入定位到组内最早的开始时间，
+    解码后的画面和声音经 split/asplit 分成多路，每路按 trim 截取自己的时间范围后分别编码，
+    总耗时接近解码一遍覆盖范围，而不是每个片段各解码一遍。片段整段重编码，与 exact 模式结果一致。
+    :param ranges: [(开始时间, 结束时间), ...]（秒）
+    :param outputs: 与 ranges 一一对应的输出文件路径
+    :param progress: 进度回调 progress(百分比)
+    """
+    ranges = [(float(start), float(end)) for start, end in ranges]
+    if not ranges or len(ranges) != len(outputs):
+        raise ValueError("片段范围与输出文件数量不一致")
+    for start, end in ranges:
+        if end <= start:
+            raise ValueError("结束时间必须大于开始时间")
+
+    has_audio = stream_info(source)['audio_codec'] is not None
+    groups = group_ranges(ranges)
+    spans = [max(ranges[i][1] for i in group) - min(ranges[i][0] for i in group) for group in groups]
+    total = sum(spans)
+    done = 0.0
+    for group, span in zip(groups, spans):
+        group_progress = _scaled_progress(progress, done, span, total) if progress else None
+        _cut_pass(source, [ranges[i] for i in group], [outputs[i] for i in group], has_audio, group_progress)
+        done += span
+
+
+def _cut_pass(source, ranges, outputs, has_audio, progress):
+    """解码一遍 [最早开始, 最晚结束]，导出其中的全部片段"""
+    first = min(start for start, _ in ranges)
+    last = max(end for _, end in ranges)
+    count = len(ranges)
+
+    # 输入从 first 开始，时间戳归零，各路的截取时间相应平移
+    graph = ['[0:v:0]split=%d%s' % (count, ''.join(f'[v{i}]' for i in range(count)))]
+    if has_audio:
+        graph.append('[0:a:0]asplit=%d%s' % (count, ''.join(f'[a{i}]' for i in range(count))))
+    for i, (start, end) in enumerate(ranges):
+        graph.append(f'[v{i}]trim=start={start - first:.3f}:end={end - first:.3f},setpts=PTS-STARTPTS[ov{i}]')
+        if has_audio:
+            graph.append(f'[a{i}]atrim=start={start - first:.3f}:end={end - first:.3f},asetpts=PTS-STARTPTS[oa{i}]')
+
+    cmd = [FFMPEG_CMD, '-y', '-ss', f"{first:.3f}", '-t', f"{last - first:.3f}", '-i', source,
+           '-filter_complex', ';'.join(graph)]
+    tmp_outputs = [output + '.cutting' for output in outputs]
+    for i, tmp_output in enumerate(tmp_outputs):
+        cmd += ['-map', f'[ov{i}]']
+        if has_audio:
+            cmd += ['-map', f'[oa{i}]', '-c:a', 'aac']
+        cmd += ['-c:v', 'libx264', '-preset', CLIP_PRESET, '-crf', str(CLIP_CRF),
+                '-movflags', '+faststart', '-f', 'mp4', tmp_output]
+
+    try:
+        _run(cmd, last - first, progress)
+        for tmp_output, output in zip(tmp_outputs, outputs):
+            os.replace(tmp_output, output)
+    finally:
+        for tmp_output in tmp_outputs:
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
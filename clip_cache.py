@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+from clip import cut_clip, cut_many, CLIP_MODE, CLIP_PRESET, CLIP_CRF
+
+
+def normalize_time(seconds):
+    """起止时间统一到毫秒，7.3 和 "7.300" 视为同一个剪辑点"""
+    return round(float(seconds), 3)
+
+
+class ClipCache:
+    """
+    剪辑结果缓存。键由源文件身份（路径、大小、修改时间）、规范化的起止时间和编码参数组成，
+    源文件被替换后旧片段自然失效。相同的剪辑请求并发到达时只剪辑一次，其余请求等待同一结果。
+    剪辑结果作为片段登记在目录索引（Catalog）的 segments 表中，缓存键即片段的 cache_key。
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        # 正在剪辑的键 -> Future，后到的相同请求等待它
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(source, start, end, mode):
+        stat = os.stat(source)
+        identity = [os.path.abspath(source), stat.st_size, stat.st_mtime_ns,
+                    normalize_time(start), normalize_time(end), mode, CLIP_PRESET, CLIP_CRF]
+        return hashlib.sha1(json.dumps(identity).encode()).hexdigest()
+
+    def _claim(self, key):
+        """
+        查询缓存并登记剪辑，须在持有锁时调用
+        :return: ('hit', 片段路径)、('wait', Future) 或 ('lead', Future)
+        """
+        segment = self.catalog.segment_by_cache_key(key)
+        if segment and os.path.exists(segment['path']):
+            self.hits += 1
+            return 'hit', segment['path']
+        flight = self.pending.get(key)
+        if flight:
+            self.coalesced += 1
+            return 'wait', flight
+        flight = self.pending[key] = Future()
+        self.misses += 1
+        return 'lead', flight
+
+    @staticmethod
+    def window_key(video_key, start, end, mode):
+        """片段优先下载的缓存键：源是只含所需子分段的临时文件，用视频键代替源文件身份"""
+        identity = ['window', video_key, normalize_time(start), normalize_time(end), mode, CLIP_PRESET, CLIP_CRF]
+        return hashlib.sha1(json.dumps(identity).encode()).hexdigest()
+
+    def _register(self, key, video_key, start, end, path, mode):
+        """把剪辑好的片段连同编码参数登记到目录索引"""
+        settings = {'mode': mode, 'preset': CLIP_PRESET, 'crf': CLIP_CRF}
+        self.catalog.add_segment(video_key, path, normalize_time(start), normalize_time(end), settings, key)
+
+    def cut(self, video_key, source, start, end, output, mode=None, progress=None):
+        """
+        返回缓存的片段，未命中时调用 cut_clip 剪辑并登记
+        :param video_key: 源视频在下载存储中的键，片段登记在它名下
+        :param progress: 进度回调 progress(百分比)，只有实际执行剪辑的请求会收到
+        :return: (片段路径, 是否命中缓存)
+        """
+        mode = mode or CLIP_MODE
+        return self._cut_once(self.key(source, start, end, mode), video_key, start, end, output,
+                              lambda: cut_clip(source, start, end, output, mode, progress))
+
+    def cut_window(self, video_key, start, end, output, mode, cut):
+        """
+        片段优先下载的剪辑，缓存键见 window_key，登记的模式为 window
+        :param cut: cut() 下载子分段并剪辑到 output，只有未命中缓存时调用
+        :return: (片段路径, 是否命中缓存)
+        """
+        def run():
+            cut()
+            return 'window'
+        return self._cut_once(self.window_key(video_key, start, end, mode), video_key, start, end, output, run)
+
+    def _cut_once(self, key, video_key, start, end, output, cut):
+        """
+        查询缓存，未命中时调用 cut() 剪辑并登记，并发的相同请求等待同一结果
+        :param cut: cut() 返回登记的剪辑模式
+        """
+        with self.lock:
+            state, value = self._claim(key)
+        if state == 'hit':
+            return value, True
+        if state == 'wait':
+            # 已有相同的剪辑正在进行，等待它的结果
+            return value.result(), True
+
+        try:
+            used_mode = cut()
+            self._register(key, video_key, start, end, output, used_mode)
+            value.set_result(output)
+            return output, False
+        except Exception as e:
+            value.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def cut_many(self, video_key, source, ranges, outputs, progress=None):
+        """
+        批量剪辑：已缓存的直接返回，其余由 clip.cut_many 按时间分组、每组解码一遍导出。
+        批量导出整段重编码，按 exact 模式登记，之后单独请求 exact 片段也能命中。
+        :param ranges: [(开始时间, 结束时间), ...]
+        :param outputs: 与 ranges 对应的输出路径
+        :return: 与 ranges 对应的 [(片段路径, 是否命中缓存), ...]
+        """
+        keys = [self.key(source, start, end, 'exact') for start, end in ranges]
+        results = [None] * len(ranges)
+        leading = {}
+        waiting = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in leading:
+                    # 同一批中重复的范围
+                    waiting.append((i, leading[key][1]))
+                    continue
+                state, value = self._claim(key)
+                if state == 'hit':
+                    results[i] = (value, True)
+                elif state == 'wait':
+                    waiting.append((i, value))
+                else:
+                    leading[key] = (i, value)
+
+        if leading:
+            indexes = [i for i, _ in leading.values()]
+            try:
+                cut_many(source, [ranges[i] for i in indexes], [outputs[i] for i in indexes], progress)
+                for key, (i, flight) in leading.items():
+                    self._register(key, video_key, ranges[i][0], ranges[i][1], outputs[i], 'exact')
+                for key, (i, flight) in leading.items():
+                    flight.set_result(outputs[i])
+                    results[i] = (outputs[i], False)
+            except Exception as e:
+                for _, flight in leading.values():
+                    flight.set_exception(e)
+                raise
+            finally:
+                with self.lock:
+                    for key in leading:
+                        self.pending.pop(key, None)
+
+        for i, flight in waiting:
+            results[i] = (flight.result(), True)
+        return results
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.coalesced + self.misses
+            return {
+                'hits': self.hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.coalesced) / requests, 4) if requests else 0.0,
+                'entries': self.catalog.count_cached_segments(),
+                'in_flight': len(self.pending),
+            }
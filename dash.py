@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import struct
+from collections import namedtuple
+
+from downloader import fetch_range
+
+# sidx 中的一个子分段：文件中的闭区间字节范围及其起始时间、时长（秒）
+Fragment = namedtuple('Fragment', ['first_byte', 'last_byte', 'start', 'duration'])
+
+
+def parse_byte_range(text):
+    """解析 '1008-1535' 形式的闭区间字节范围"""
+    first, last = text.split('-')
+    return int(first), int(last)
+
+
+def segment_base(stream):
+    """
+    读取播放信息中流的 SegmentBase
+    :return: (初始化段字节范围, sidx 索引字节范围)
+    """
+    base = stream.get('segment_base') or {}
+    init_range, index_range = base.get('initialization'), base.get('index_range')
+    if not (init_range and index_range):
+        base = stream.get('SegmentBase') or {}
+        init_range, index_range = base.get('Initialization'), base.get('indexRange')
+    if not (init_range and index_range):
+        raise ValueError("播放信息中没有 SegmentBase")
+    return parse_byte_range(init_range), parse_byte_range(index_range)
+
+
+def parse_sidx(data, data_offset):
+    """
+    解析 sidx 盒子，得到每个子分段的字节范围和时间范围
+    :param data: 以 sidx 盒子开头（或包含它）的字节
+    :param data_offset: data 第一个字节在文件中的偏移
+    :return: Fragment 列表
+    """
+    pos = 0
+    while pos + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        if box_type == b'sidx':
+            break
+        if size < 8:
+            raise ValueError("sidx 索引损坏")
+        pos += size
+    else:
+        raise ValueError("索引范围内没有 sidx 盒子")
+
+    box_start = pos
+    version = data[pos + 8]
+    timescale = struct.unpack_from('>I', data, pos + 16)[0]
+    if version == 0:
+        earliest, first_offset = struct.unpack_from('>II', data, pos + 20)
+        pos += 28
+    else:
+        earliest, first_offset = struct.unpack_from('>QQ', data, pos + 20)
+        pos += 36
+    reference_count = struct.unpack_from('>H', data, pos + 2)[0]
+    pos += 4
+
+    # 第一个子分段紧跟在 sidx 盒子之后，再加上 first_offset
+    offset = data_offset + box_start + size + first_offset
+    time = earliest
+    fragments = []
+    for _ in range(reference_count):
+        referenced, duration, _sap = struct.unpack_from('>III', data, pos)
+        pos += 12
+        referenced_size = referenced & 0x7FFFFFFF
+        fragments.append(Fragment(offset, offset + referenced_size - 1, time / timescale, duration / timescale))
+        offset += referenced_size
+        time += duration
+    return fragments
+
+
+def select_fragments(fragments, start, end):
+    """选出与时间窗口 [start, end] 有交集的连续子分段"""
+    selected = [f for f in fragments if f.start < end and f.start + f.duration > start]
+    if not selected:
+        raise ValueError(f"时间范围 {start}-{end} 超出视频时长")
+    return selected
+
+
+def fetch_window(url, stream, headers, start, end, path):
+    """
+    只下载覆盖时间窗口的初始化段和子分段，拼成一个可独立解码的分片 mp4
+    :param url: 流地址
+    :param stream: 播放信息中的流描述（含 SegmentBase）
+    :param headers: 请求头
+    :param start: 窗口开始时间（秒）
+    :param end: 窗口结束时间（秒）
+    :param path: 输出文件路径
+    :return: 输出文件中第一个子分段的开始时间（秒）
+    """
+    (init_first, init_last), (index_first, index_last) = segment_base(stream)
+
+    # 初始化段和索引通常相邻，一次请求取回
+    head = fetch_range(url, headers, min(init_first, index_first), max(init_last, index_last))
+    head_offset = min(init_first, index_first)
+    init = head[init_first - head_offset:init_last - head_offset + 1]
+    index = head[index_first - head_offset:index_last - head_offset + 1]
+
+    fragments = select_fragments(parse_sidx(index, index_first), start, end)
+    with open(path, 'wb') as f:
+        f.write(init)
+        fetch_range(url, headers, fragments[0].first_byte, fragments[-1].last_byte, f)
+    return fragments[0].start
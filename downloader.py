@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+import requests
+
+from mirrors import MirrorSet, selector, MIRROR_SLOW_RATIO, MIRROR_CHECK_AFTER
+
+# 每路流的并发连接数
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+# 每个分段的字节数
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+# 所有连接共享的总带宽上限（字节/秒），0 表示不限速
+DOWNLOAD_MAX_BANDWIDTH = int(os.environ.get('DOWNLOAD_MAX_BANDWIDTH', 0))
+# 单个分段失败后的重试次数
+DOWNLOAD_RETRIES = 3
+# 单次读取的字节数
+READ_SIZE = 64 * 1024
+# 连接/读取超时（秒）
+TIMEOUT = (10, 30)
+# 下载进度回调的间隔（秒）
+PROGRESS_INTERVAL = 0.5
+# 部分文件超过该时间（秒）未更新视为废弃，会被清理
+PARTIAL_MAX_AGE = int(os.environ.get('PARTIAL_MAX_AGE', 3 * 24 * 3600))
+
+PARTIAL_SUFFIX = '.part'
+JOURNAL_SUFFIX = '.journal'
+
+_local = threading.local()
+
+
+def _session():
+    """每个线程复用自己的 Session，保持连接"""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+class RateLimiter:
+    """令牌桶限速器，所有下载线程共享同一个总带宽"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RangeJournal:
+    """记录部分文件中已完成的字节范围，保存在部分文件旁边，用于断点续传"""
+
+    def __init__(self, path, total, done=None):
+        self.path = path + JOURNAL_SUFFIX
+        self.total = total
+        self.done = done or []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, total):
+        """读取已有日志；文件大小不一致或部分文件缺失时从头开始"""
+        try:
+            with open(path + JOURNAL_SUFFIX, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('total') == total and os.path.getsize(path) == total:
+                return cls(path, total, [tuple(r) for r in data.get('done', [])])
+        except (OSError, ValueError):
+            pass
+        return cls(path, total)
+
+    @property
+    def completed(self):
+        return sum(end - start + 1 for start, end in self.done)
+
+    def missing(self):
+        """返回尚未下载的闭区间字节范围"""
+        gaps = []
+        cursor = 0
+        for start, end in self.done:
+            if start > cursor:
+                gaps.append((cursor, start - 1))
+            cursor = max(cursor, end + 1)
+        if cursor < self.total:
+            gaps.append((cursor, self.total - 1))
+        return gaps
+
+    def add(self, start, end):
+        """登记一个已写入文件的范围，合并相邻区间后落盘"""
+        with self.lock:
+            merged = []
+            for r_start, r_end in sorted(self.done + [(start, end)]):
+                if merged and r_start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+                else:
+                    merged.append((r_start, r_end))
+            self.done = merged
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'total': self.total, 'done': self.done}, f)
+        os.replace(tmp_path, self.path)
+
+
+def discard_partial(path):
+    """删除部分文件及其日志"""
+    for p in (path, path + JOURNAL_SUFFIX):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def cleanup_partials(directory, max_age=None):
+    """
+    清理长时间未更新的部分文件及其日志，以及失去部分文件的孤立日志
+    :return: 删除的部分文件数
+    """
+    max_age = PARTIAL_MAX_AGE if max_age is None else max_age
+    now = time.time()
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file():
+            continue
+        try:
+            if entry.name.endswith(PARTIAL_SUFFIX) and now - entry.stat().st_mtime > max_age:
+                discard_partial(entry.path)
+                removed += 1
+            elif entry.name.endswith(JOURNAL_SUFFIX) and not os.path.exists(entry.path[:-len(JOURNAL_SUFFIX)]):
+                os.remove(entry.path)
+        except OSError:
+            pass
+    return removed
+
+
+class StreamStats:
+    """单路流的下载统计"""
+
+    def __init__(self, name, total=0, resumed=0):
+        self.name = name
+        self.total = total
+        # 续传时已存在、无需重新下载的字节数
+        self.resumed = resumed
+        self.downloaded = 0
+        self.start = time.monotonic()
+        self.end = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def add(self, n):
+        with self.lock:
+            self.downloaded += n
+
+    def expect(self, n):
+        """登记待完成的分段数"""
+        self.pending += n
+
+    def done(self, _future=None):
+        """一个分段完成，全部完成时记录结束时间"""
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                self.end = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def throughput(self):
+        """平均吞吐（字节/秒）"""
+        return self.downloaded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'total': self.total,
+            'resumed': self.resumed,
+            'downloaded': self.downloaded,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 1),
+        }
+
+    def __str__(self):
+        text = (f"{self.name}: {self.downloaded / 1024 / 1024:.2f} MB, "
+                f"{self.elapsed:.2f}秒, {self.throughput / 1024 / 1024:.2f} MB/s")
+        if self.resumed:
+            text += f", 续传跳过 {self.resumed / 1024 / 1024:.2f} MB"
+        return text
+
+
+def probe_size(url, headers):
+    """
+    用 Range: bytes=0-0 探测文件大小以及服务器是否支持分段请求
+    :return: (文件大小, 是否支持Range)，大小未知时为 0
+    """
+    with _session().get(url, headers={**headers, 'Range': 'bytes=0-0'}, stream=True, timeout=TIMEOUT) as resp:
+        resp.raise_for_status()
+        if resp.status_code == 206:
+            content_range = resp.headers.get('Content-Range', '')
+            total = content_range.rsplit('/', 1)[-1]
+            if total.isdigit():
+                return int(total), True
+        return int(resp.headers.get('Content-Length') or 0), False
+
+
+def split_ranges(ranges, chunk_size):
+    """把若干闭区间字节范围切分为不超过 chunk_size 的分段"""
+    return [(start, min(start + chunk_size - 1, r_end))
+            for r_start, r_end in ranges
+            for start in range(r_start, r_end + 1, chunk_size)]
+
+
+class _SlowMirror(IOError):
+    """当前镜像传输速度明显低于预期"""
+
+
+def _fetch_range(mirrors, headers, path, start, end, stats, limiter, journal):
+    """
+    下载一个字节范围并写入文件的对应位置。
+    当前镜像出错或明显变慢时，已写入的部分记入日志，剩余部分换下一个镜像继续。
+    """
+    pos = start
+    failures = 0
+    while pos <= end:
+        url = mirrors.current
+        written = 0
+        started = time.monotonic()
+        try:
+            with mirrors.ranker.connection(url), \
+                    _session().get(url, headers={**headers, 'Range': f'bytes={pos}-{end}'},
+                                   stream=True, timeout=TIMEOUT) as resp:
+                resp.raise_for_status()
+                if resp.status_code != 206:
+                    raise IOError(f"服务器未返回分段内容: HTTP {resp.status_code}")
+                with open(path, 'r+b') as f:
+                    f.seek(pos)
+                    for chunk in resp.iter_content(chunk_size=READ_SIZE):
+                        limiter.consume(len(chunk))
+                        f.write(chunk)
+                        written += len(chunk)
+                        stats.add(len(chunk))
+
+                        # 限速时实测速度不代表镜像能力，不做判断。
+                        # 与该主机上所有连接平分的预期吞吐比较，连接数随其他分段起止变化
+                        elapsed = time.monotonic() - started
+                        if (elapsed > MIRROR_CHECK_AFTER and not limiter.rate and mirrors.has_fallback()
+                                and written / elapsed < mirrors.expected_throughput(url) * MIRROR_SLOW_RATIO):
+                            raise _SlowMirror(f"镜像变慢: {written / elapsed / 1024:.0f} KB/s")
+                connections = mirrors.ranker.connections(url)
+            if written != end - pos + 1:
+                raise IOError(f"分段不完整: {pos}-{end}, 实际 {written} 字节")
+            mirrors.ranker.record(url, written, time.monotonic() - started, connections)
+            journal.add(pos, end)
+            return
+        except (requests.RequestException, IOError) as e:
+            # 已完整写入的部分保留，下一次从断点继续
+            if written:
+                journal.add(pos, pos + written - 1)
+                pos += written
+            if mirrors.switch(url):
+                continue
+            if isinstance(e, _SlowMirror):
+                continue
+            failures += 1
+            if failures > DOWNLOAD_RETRIES:
+                raise
+            time.sleep(2 ** (failures - 1))
+
+
+def _fetch_whole(url, headers, path, stats, limiter):
+    """服务器不支持 Range 时退化为单连接下载"""
+    with _session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+        resp.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=READ_SIZE):
+                limiter.consume(len(chunk))
+                f.write(chunk)
+                stats.add(len(chunk))
+
+
+def fetch_range(url, headers, start, end, fileobj=None):
+    """
+    获取一个闭区间字节范围
+    :param fileobj: 给出时顺序写入该文件对象并返回写入字节数，否则返回字节内容
+    """
+    chunks = []
+    written = 0
+    with _session().get(url, headers={**headers, 'Range': f'bytes={start}-{end}'},
+                        stream=True, timeout=TIMEOUT) as resp:
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise IOError(f"服务器未返回分段内容: HTTP {resp.status_code}")
+        for chunk in resp.iter_content(chunk_size=READ_SIZE):
+            if fileobj is None:
+                chunks.append(chunk)
+            else:
+                fileobj.write(chunk)
+            written += len(chunk)
+    if written != end - start + 1:
+        raise IOError(f"分段不完整: {start}-{end}, 实际 {written} 字节")
+    return written if fileobj is not None else b''.join(chunks)
+
+
+def pipe_stream(url, headers, fileobj, stats, limiter=None):
+    """
+    单连接读取整个响应体并顺序写入文件对象（如管道），不落盘
+    :return: 写入的字节数
+    """
+    limiter = limiter or RateLimiter(DOWNLOAD_MAX_BANDWIDTH)
+    with _session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+        resp.raise_for_status()
+        stats.total = int(resp.headers.get('Content-Length') or 0)
+        for chunk in resp.iter_content(chunk_size=READ_SIZE):
+            limiter.consume(len(chunk))
+            fileobj.write(chunk)
+            stats.add(len(chunk))
+    stats.end = time.monotonic()
+    return stats.downloaded
+
+
+def download_percent(stats):
+    """多路流合计的完成百分比，续传跳过的字节计为已完成"""
+    stats = list(stats)
+    total = sum(s.total for s in stats)
+    if not total:
+        return 100.0 if stats and all(s.end for s in stats) else 0.0
+    return min(sum(s.resumed + s.downloaded for s in stats) / total * 100, 100.0)
+
+
+def download_streams(streams, headers, workers=None, chunk_size=None, max_bandwidth=None, progress=None):
+    """
+    同时下载多路流，每路流按字节范围切分后由多个连接并发获取。
+    已完成的范围记录在部分文件旁的日志中，重试时只请求缺失的范围；
+    日志在调用方确认文件可用后通过 discard_partial 删除。
+    :param streams: {名称: (url 或按优先级排列的镜像 url 列表, 保存路径)}
+    :param headers: 请求头
+    :param workers: 每路流的并发连接数，默认 DOWNLOAD_WORKERS
+    :param chunk_size: 分段大小，默认 DOWNLOAD_CHUNK_SIZE
+    :param max_bandwidth: 总带宽上限（字节/秒），默认 DOWNLOAD_MAX_BANDWIDTH
+    :param progress: 进度回调 progress(百分比)，每 PROGRESS_INTERVAL 秒调用一次
+    :return: {名称: StreamStats}
+    """
+    workers = workers or DOWNLOAD_WORKERS
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    limiter = RateLimiter(DOWNLOAD_MAX_BANDWIDTH if max_bandwidth is None else max_bandwidth)
+
+    stats = {}
+    pools = []
+    futures = []
+    try:
+        for name, (urls, path) in streams.items():
+            if isinstance(urls, str):
+                urls = [urls]
+            mirrors = MirrorSet(selector.rank(urls, headers, chunk_size))
+            url = mirrors.current
+            total, ranged = probe_size(url, headers)
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"dl-{name}")
+            pools.append(pool)
+
+            if not ranged or total == 0:
+                discard_partial(path)
+                stats[name] = StreamStats(name, total)
+                tasks = [(_fetch_whole, url, headers, path, stats[name], limiter)]
+            else:
+                journal = RangeJournal.load(path, total)
+                if not journal.done:
+                    # 预分配文件，各分段直接写入对应偏移
+                    with open(path, 'wb') as f:
+                        f.truncate(total)
+                    journal.save()
+                stats[name] = StreamStats(name, total, resumed=journal.completed)
+                tasks = [(_fetch_range, mirrors, headers, path, start, end, stats[name], limiter, journal)
+                         for start, end in split_ranges(journal.missing(), chunk_size)]
+
+            if not tasks:
+                stats[name].end = stats[name].start
+            stats[name].expect(len(tasks))
+            for task in tasks:
+                future = pool.submit(*task)
+                future.add_done_callback(stats[name].done)
+                futures.append(future)
+
+        # 等待全部分段完成，任何一段失败都视为整体失败
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+            if progress:
+                progress(download_percent(stats.values()))
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    return stats
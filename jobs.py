@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 同时执行的任务数
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# 批量下载等长任务单独排队，同时执行的数量，不占用交互任务（剪辑、预览、处理）的线程
+JOB_BATCH_WORKERS = int(os.environ.get('JOB_BATCH_WORKERS', 1))
+# 保留的已结束任务数，超出后丢弃最早结束的
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', 200))
+# SSE 连接上没有新进度时发送心跳的间隔（秒）
+JOB_HEARTBEAT = 15
+# 查询其他工作进程接受的任务时，读取共享状态的间隔（秒）
+JOB_POLL_INTERVAL = 0.5
+
+FINISHED = ('done', 'failed')
+
+
+class Job:
+    """一个后台任务及其分阶段进度（下载、编码、服务调用等）"""
+
+    def __init__(self, kind, params=None, store=None):
+        """:param store: store(job)，每次状态变化后调用，把状态写入共享存储"""
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = 'queued'
+        self.stage = None
+        self.progress = {}
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+        # 每次状态变化递增，供 SSE 判断是否有新进度
+        self.version = 0
+        self.changed = threading.Condition()
+        self.store = store
+
+    def report(self, stage, percent=None, message=None):
+        """
+        报告进度
+        :param stage: 阶段名称，如 download/encode/service
+        :param percent: 本阶段完成百分比，未知时为 None
+        :param message: 附加说明
+        """
+        with self.changed:
+            self.stage = stage
+            if percent is not None:
+                self.progress[stage] = round(min(max(percent, 0), 100), 1)
+            else:
+                self.progress.setdefault(stage, None)
+            if message is not None:
+                self.message = message
+            self._touch()
+
+    def finish(self, result=None, error=None):
+        with self.changed:
+            self.status = 'failed' if error else 'done'
+            self.result = result
+            self.error = error
+            self._touch()
+
+    def _touch(self):
+        self.updated = time.time()
+        self.version += 1
+        self.changed.notify_all()
+        if self.store:
+            self.store(self)
+
+    def snapshot(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': dict(self.progress),
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'updated': self.updated,
+        }
+
+    def wait(self, version, timeout):
+        """等待版本号超过 version 或超时，返回当前版本号"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version > version, timeout)
+            return self.version
+
+
+class StoredJob:
+    """其他工作进程接受的任务，状态从共享的目录索引中读取，接口与 Job 的查询部分相同"""
+
+    def __init__(self, catalog, row):
+        self.catalog = catalog
+        self.id = row['id']
+        self._load(row)
+
+    def _load(self, row):
+        self.status = row['status']
+        self.version = row['version']
+        self.row = row
+
+    def snapshot(self):
+        row = self.row
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'stage': row['stage'],
+            'progress': row['progress'],
+            'message': row['message'],
+            'result': row['result'],
+            'error': row['error'],
+            'created': row['created'],
+            'updated': row['updated'],
+        }
+
+    def wait(self, version, timeout):
+        """轮询共享状态，直到版本号超过 version 或超时，返回当前版本号"""
+        deadline = time.time() + timeout
+        while self.version <= version:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(JOB_POLL_INTERVAL, remaining))
+            row = self.catalog.get_job(self.id)
+            if row:
+                self._load(row)
+        return self.version
+
+
+class JobManager:
+    """
+    有界线程池上的任务队列，提交后立即返回任务ID。
+    除默认队列外可以有若干命名队列，各用自己的线程池，长任务排满时不影响默认队列。
+    给出目录索引时任务状态同时写入其中，请求落到其他工作进程时也能查询进度
+    """
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY, queues=None, catalog=None):
+        """
+        :param queues: 命名队列 -> 同时执行的任务数
+        :param catalog: 多个工作进程共享的目录索引，None 时任务状态只在本进程内
+        """
+        self.executors = {None: ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')}
+        for name, count in (queues or {}).items():
+            self.executors[name] = ThreadPoolExecutor(max_workers=count, thread_name_prefix=f'job-{name}')
+        self.history = history
+        self.catalog = catalog
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, kind, func, params=None, queue=None):
+        """
+        提交任务
+        :param func: func(job) 返回 (结果, 错误)，错误为 None 表示成功
+        :param queue: 命名队列，None 为默认队列
+        """
+        job = Job(kind, params, store=self._store if self.catalog else None)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+        if self.catalog:
+            self._store(job)
+        self.executors[queue].submit(self._run, job, func)
+        return job
+
+    def get(self, job_id):
+        """本进程的任务返回 Job，其他工作进程的任务返回 StoredJob，不存在时返回 None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.catalog:
+            row = self.catalog.get_job(job_id)
+            job = StoredJob(self.catalog, row) if row else None
+        return job
+
+    def _store(self, job):
+        self.catalog.put_job(job.snapshot(), job.version)
+
+    def _run(self, job, func):
+        with job.changed:
+            job.status = 'running'
+            job._touch()
+        try:
+            result, error = func(job)
+        except Exception as e:
+            result, error = None, str(e)
+        job.finish(result, error)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(len(self.jobs) - self.history, 0)]:
+            del self.jobs[job_id]
+        if self.catalog:
+            self.catalog.trim_jobs(FINISHED, self.history)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+def _lock_file(f):
+    if os.name == 'nt':
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK 重试约 10 秒仍未取得锁时抛出，继续等待
+                continue
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if os.name == 'nt':
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class KeyLock:
+    """
+    按键加的互斥锁，同时在线程和工作进程之间生效：
+    同一进程内的线程先排队取得该键的 threading.Lock，再对锁文件加 fcntl/msvcrt 锁与其他进程互斥。
+    锁文件保存在 directory 下，不删除，避免删除时其他进程正在等待同一文件。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # 键 -> [threading.Lock, 等待或持有该锁的线程数]，没有线程使用时移除
+        self.locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def hold(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                with open(os.path.join(self.directory, f"{key}.lock"), 'a+b') as f:
+                    _lock_file(f)
+                    try:
+                        yield
+                    finally:
+                        _unlock_file(f)
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
@@ -1,38 +1,79 @@
-import glob
 import hashlib
-import re
+import json
 import requests
 
-from flask import Flask, render_template, request, jsonify, send_from_directory, abort
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from flask import Flask, Response, render_template, request, jsonify, abort
 
 from utils.clients import *
-from video import get_video
+from clip import CLIP_MODE
+from jobs import JobManager, FINISHED, JOB_HEARTBEAT, JOB_BATCH_WORKERS
+from media import send_media
+from page_info import PageParseError
+from storage import StorageManager
+from video import get_video, get_videos, part_urls, download_clip, clip_filename, store, catalog, clip_cache, \
+    DOWNLOAD_DIR
 
 app = Flask(__name__)
 
-DOWNLOAD_DIR = os.path.join(os.getcwd(), 'downloads')
 # 确保下载目录存在
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-# 用于跟踪视频片段的字典
-video_segments = {}
 
-# 视频缓存
-video_cache = {}
+# 可从请求中传给 get_video 的清晰度选择参数
+QUALITY_OPTIONS = ('resolution', 'codec', 'max_bytes')
 
+# 只需要音频的处理操作，带视频链接时只下载音频流
+AUDIO_ONLY_ACTIONS = ('vocal_remove', 'extract_subtitle')
 
-def get_video_hash(url):
-    """生成视频URL的哈希值作为缓存键"""
+# 处理操作 -> (输出文件名后缀, 操作名称)，输出文件名为 处理对象的文件名_后缀，不同视频和片段的结果互不覆盖
+ACTION_OUTPUTS = {
+    'vocal_remove': ('vocal_removed.wav', '伴奏提取'),
+    'extract_subtitle': ('subtitle.srt', '字幕提取'),
+    'enhance_audio': ('video_enhanced.mp4', '人声增强'),
+}
+
+# 下载目录的容量管理，超过水位时按最近访问时间清理未被占用的文件
+storage = StorageManager(DOWNLOAD_DIR, catalog)
+storage.start()
+
+# 后台任务队列，请求带 async 参数时提交到这里并立即返回任务ID；批量下载在单独的 batch 队列中执行。
+# 任务状态写入共享的目录索引，查询请求落到其他工作进程时同样能返回进度
+job_manager = JobManager(queues={'batch': JOB_BATCH_WORKERS}, catalog=catalog)
+
+
+def no_progress(stage, percent=None, message=None):
+    """同步请求不需要报告进度"""
+
+
+def get_video_hash(url, options=None):
+    """生成视频URL（及清晰度选择参数）的哈希值作为缓存键"""
+    if options:
+        url = f"{url}|{sorted(options.items())}"
     return hashlib.md5(url.encode()).hexdigest()
 
 
+def get_quality_options(data):
+    """从请求数据中取出清晰度选择参数"""
+    return {name: data[name] for name in QUALITY_OPTIONS if data.get(name) is not None}
+
+# 片段列表每页的默认条数和最大条数
+SEGMENT_PAGE_SIZE = 50
+SEGMENT_PAGE_SIZE_MAX = 200
+
+
 @app.route('/downloads/<path:filename>')
 def downloads(filename):
     requested_path = os.path.abspath(os.path.join(DOWNLOAD_DIR, filename))
-    if not requested_path.startswith(DOWNLOAD_DIR):
+    if not requested_path.startswith(DOWNLOAD_DIR + os.sep):
         abort(404)
-    return send_from_directory(DOWNLOAD_DIR, filename)
+    # 隐藏文件和隐藏目录不对外提供
+    if any(part.startswith('.') for part in os.path.relpath(requested_path, DOWNLOAD_DIR).split(os.sep)):
+        abort(404)
+    storage.touch(requested_path)
+    response = send_media(DOWNLOAD_DIR, filename)
+    if response is None:
+        abort(404)
+    return response
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -56,39 +97,38 @@ def preview_video():
         if not video_url:
             return jsonify({'error': '缺少视频URL参数'}), 400
 
-        # 检查缓存
-        video_hash = get_video_hash(video_url)
-        if video_hash in video_cache:
-            return jsonify(video_cache[video_hash])
+        # 检查缓存，视频文件已被删除的缓存条目作废
+        options = get_quality_options(data)
+        video_hash = get_video_hash(video_url, options)
+        cached = catalog.get_url(video_hash)
+        if cached and store.get(cached['video_id']):
+            storage.open_session(cached['video_id'])
+            return jsonify(cached)
 
         # 获取视频信息
-        title = get_video(video_url)
-        safe_title = re.sub(r'[\\/:"*?<>|]+', '', title)
-        filename = f"{safe_title}.mp4"
-        video_path = os.path.join(DOWNLOAD_DIR, filename)
+        record = get_video(video_url, **options)
+        key = record['key']
+        video_path = store.file_path(record)
 
         if not os.path.exists(video_path):
             return jsonify({'error': '视频文件不存在'}), 500
 
-        # 初始化视频片段跟踪
-        if safe_title not in video_segments:
-            video_segments[safe_title] = {
-                'original_path': video_path,
-                'segments': []
-            }
-
         response_data = {
-            'title': title,
-            'video_url': f'/downloads/{filename}'
+            'video_id': key,
+            'title': record['title'],
+            'video_url': f"/downloads/{record['filename']}"
         }
 
         # 更新缓存
-        video_cache[video_hash] = response_data
+        catalog.put_url(video_hash, key, response_data)
+        storage.open_session(key)
 
         return jsonify(response_data)
 
     except requests.RequestException as e:
         return jsonify({'error': f'请求B站失败: {str(e)}'}), 502
+    except PageParseError as e:
+        return jsonify({'error': str(e), 'missing': e.missing}), 400
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
@@ -99,28 +139,34 @@ def preview_video():
 def get_segments():
     try:
         data = request.get_json()
+        key = data.get('video_id')
         title = data.get('title')
-        safe_title = re.sub(r'[\\/:"*?<>|]+', '', title)
-
-        if safe_title not in video_segments:
-            return jsonify({'segments': []})
-
-        segments = []
-        for segment in video_segments[safe_title]['segments']:
-            # 从文件名中提取时间信息
-            filename = os.path.basename(segment)
-            time_match = re.search(r'_(\d+)-(\d+)_', filename)
-            if time_match:
-                start_time = float(time_match.group(1))
-                end_time = float(time_match.group(2))
-                segments.append({
-                    'title': title,
-                    'start': start_time,
-                    'end': end_time,
-                    'url': f'/downloads/{os.path.basename(segment)}'
-                })
+        try:
+            page = max(int(data.get('page', 1)), 1)
+            page_size = min(max(int(data.get('page_size', SEGMENT_PAGE_SIZE)), 1), SEGMENT_PAGE_SIZE_MAX)
+        except (TypeError, ValueError):
+            return jsonify({'error': '分页参数必须是整数'}), 400
+        if key:
+            storage.open_session(key)
+
+        # 片段的时间范围等信息在剪辑时已登记到目录索引，直接读取
+        segments = [{
+            'id': segment['id'],
+            'title': title,
+            'start': segment['start_time'],
+            'end': segment['end_time'],
+            'url': f"/downloads/{os.path.basename(segment['path'])}",
+            'size': segment['size'],
+            'settings': segment['settings'],
+            'created': segment['created']
+        } for segment in catalog.segments(key, (page - 1) * page_size, page_size)]
 
-        return jsonify({'segments': segments})
+        return jsonify({
+            'segments': segments,
+            'total': catalog.count_segments(key),
+            'page': page,
+            'page_size': page_size
+        })
 
     except Exception as e:
         return jsonify({'error': f'获取片段列表失败: {str(e)}'}), 500
@@ -130,44 +176,24 @@ def get_segments():
 def finish_download():
     try:
         data = request.get_json()
-        title = data.get('title')
-        if not title:
-            return jsonify({'error': '缺少标题参数'}), 400
-
-        safe_title = re.sub(r'[\\/:"*?<>|]+', '', title)
+        key = data.get('video_id')
+        if not key:
+            return jsonify({'error': '缺少视频ID参数'}), 400
 
-        if safe_title not in video_segments:
+        if not catalog.has_segments(key) and not store.get(key):
             return jsonify({'error': '未找到视频信息'}), 404
 
-        video_info = video_segments[safe_title]
-        original_path = video_info.get('original_path')
+        # 删除原始文件及由它剪辑出的片段文件
+        try:
+            for path in store.remove(key):
+                print(f"删除视频文件: {path}")
+        except Exception as e:
+            return jsonify({'error': f'删除视频失败: {str(e)}'}), 500
 
-        # 删除原始文件
-        if original_path and os.path.exists(original_path):
-            try:
-                os.remove(original_path)
-                print(f"删除原始视频文件: {original_path}")
-            except Exception as e:
-                return jsonify({'error': f'删除原始视频失败: {str(e)}'}), 500
-
-        # 批量删除相关片段文件，假设在original_path同目录
-        if original_path:
-            directory = os.path.dirname(original_path)
-            pattern = os.path.join(directory, f"{safe_title}_*.mp4")
-            for filepath in glob.glob(pattern):
-                try:
-                    os.remove(filepath)
-                    print(f"删除片段文件: {filepath}")
-                except Exception as e:
-                    print(f"删除片段文件失败: {filepath}, 错误: {e}")
-
-        # 删除记录
-        video_segments.pop(safe_title, None)
-
-        # 清理视频缓存，建议这里也用 safe_title 比较
-        for url_hash, cache_data in list(video_cache.items()):
-            if re.sub(r'[\\/:"*?<>|]+', '', cache_data.get('title', '')) == safe_title:
-                del video_cache[url_hash]
+        # 删除片段记录和指向该视频的缓存，均按视频键索引
+        catalog.remove_segments(key)
+        catalog.remove_urls(key)
+        storage.close_session(key)
 
         return jsonify({'message': '完成当前下载，点击重置继续下载'})
 
@@ -175,118 +201,414 @@ def finish_download():
         return jsonify({'error': f'操作失败: {str(e)}'}), 500
 
 
-@app.route('/api/get_video', methods=['POST'])
-def video_api():
+def run_get_video(data, progress=no_progress):
+    """
+    下载视频，给出起止时间时剪辑片段
+    :param progress: 进度回调 progress(阶段, 百分比, 说明)
+    :return: (响应数据, HTTP状态码)
+    """
     try:
-        data = request.get_json()
         video_url = data.get('url')
         start_time = data.get('start')
         end_time = data.get('end')
 
         if not video_url:
-            return jsonify({'error': '缺少视频URL参数'}), 400
+            return {'error': '缺少视频URL参数'}, 400
 
-        title = get_video(video_url)
-        safe_title = re.sub(r'[\\/:"*?<>|]+', '', title)
-        filename = f"{safe_title}.mp4"
-        video_path = os.path.join(DOWNLOAD_DIR, filename)
+        options = get_quality_options(data)
+
+        # 有时间参数且完整视频尚未下载时，只下载片段所需的子分段
+        if start_time is not None and end_time is not None:
+            clip = download_clip(video_url, start_time, end_time, mode=data.get('cut_mode'), progress=progress,
+                                 **options)
+            if clip:
+                clip_path = os.path.join(DOWNLOAD_DIR, clip['filename'])
+                storage.open_session(clip['key'])
+                storage.check()
+                return {
+                    'video_id': clip['key'],
+                    'clip_id': catalog.segment_by_path(clip_path)['id'],
+                    'title': clip['title'],
+                    'video_url': f"/downloads/{clip['filename']}",
+                    'cached': clip['cached']
+                }, 200
+
+        record = get_video(video_url, progress=progress, **options)
+        key = record['key']
+        title = record['title']
+        filename = record['filename']
+        video_path = store.file_path(record)
 
         if not os.path.exists(video_path):
-            return jsonify({'error': '视频文件不存在，合并可能失败'}), 500
+            return {'error': '视频文件不存在，合并可能失败'}, 500
+        storage.open_session(key)
 
         # 如果提供了时间，剪辑片段
         if start_time is not None and end_time is not None:
-            clip_filename = f"{safe_title}_{start_time}-{end_time}.mp4"
-            clip_path = os.path.join(DOWNLOAD_DIR, clip_filename)
+            # 默认只重编码首尾不完整的 GOP，cut_mode 为 exact 时整段重编码
+            mode = data.get('cut_mode') or CLIP_MODE
+            clip_name = clip_filename(key, start_time, end_time, None if mode == 'smart' else mode)
+            clip_path = os.path.join(DOWNLOAD_DIR, clip_name)
 
+            pin = storage.pin(key)
             try:
-                start = float(start_time)
-                end = float(end_time)
-
-                with VideoFileClip(video_path) as clip:
-                    subclip = clip.subclip(start, end)
-                    subclip.write_videofile(
-                        clip_path,
-                        codec="libx264",
-                        audio_codec="aac",
-                        threads=4,
-                        preset="ultrafast",
-                        fps=clip.fps,
-                        logger=None  # 不输出冗余信息
-                    )
-
-                return jsonify({
+                progress('encode', 0)
+                storage.touch(video_path)
+                clip_path, hit = clip_cache.cut(key, video_path, start_time, end_time, clip_path, mode,
+                                                progress=lambda percent: progress('encode', percent))
+                progress('encode', 100, '命中剪辑缓存' if hit else f'剪辑模式: {mode}')
+                storage.touch(clip_path)
+
+                return {
+                    'video_id': key,
+                    'clip_id': catalog.segment_by_path(clip_path)['id'],
                     'title': title,
-                    'video_url': f'/downloads/{clip_filename}'
-                })
+                    'video_url': f'/downloads/{os.path.basename(clip_path)}',
+                    'cached': hit
+                }, 200
             except Exception as e:
-                return jsonify({'error': f'剪辑失败: {str(e)}'}), 500
+                return {'error': f'剪辑失败: {str(e)}'}, 500
+            finally:
+                storage.unpin(pin)
+                storage.check()
 
         # 没有时间参数，返回完整视频
-        return jsonify({
+        return {
+            'video_id': key,
             'title': title,
             'video_url': f'/downloads/{filename}'
-        })
+        }, 200
 
     except requests.RequestException as e:
-        return jsonify({'error': f'请求B站失败: {str(e)}'}), 502
+        return {'error': f'请求B站失败: {str(e)}'}, 502
+    except PageParseError as e:
+        return {'error': str(e), 'missing': e.missing}, 400
     except ValueError as e:
-        return jsonify({'error': str(e)}), 400
+        return {'error': str(e)}, 400
     except Exception as e:
-        return jsonify({'error': f'服务器错误: {str(e)}'}), 500
+        return {'error': f'服务器错误: {str(e)}'}, 500
+
+
+def submit_job(kind, handler, data, queue=None):
+    """
+    把请求提交为后台任务，立即返回任务ID
+    :param handler: handler(data, progress) 返回 (响应数据, HTTP状态码)
+    :param queue: 任务队列，长任务用 batch 队列，不挤占交互任务
+    """
+    def run(job):
+        payload, status = handler(data, job.report)
+        if status >= 400 or payload.get('success') is False:
+            return payload, payload.get('error') or payload.get('message') or '任务失败'
+        return payload, None
+
+    job = job_manager.submit(kind, run, params=data, queue=queue)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events'
+    }), 202
 
 
-@app.route('/api/video_process', methods=['POST'])
-def video_process():
+@app.route('/api/get_video', methods=['POST'])
+def video_api():
     data = request.get_json()
-    action = data.get('action')
+    if data.get('async'):
+        return submit_job('get_video', run_get_video, data)
+    payload, status = run_get_video(data)
+    return jsonify(payload), status
+
+
+def parse_ranges(ranges):
+    """校验 [[开始, 结束], ...] 形式的片段范围"""
+    if not isinstance(ranges, list) or not ranges:
+        raise ValueError("缺少 ranges 参数")
+    parsed = []
+    for item in ranges:
+        if not isinstance(item, (list, tuple)) or len(item) != 2:
+            raise ValueError(f"片段范围格式错误: {item}")
+        start, end = float(item[0]), float(item[1])
+        if start < 0 or end <= start:
+            raise ValueError(f"片段范围无效: {item}")
+        parsed.append((start, end))
+    return parsed
+
+
+def run_get_clips(data, progress=no_progress):
+    """
+    从同一视频批量剪辑多个片段，时间上相近的片段共用一遍解码
+    :return: (响应数据, HTTP状态码)
+    """
+    try:
+        video_url = data.get('url')
+        if not video_url:
+            return {'error': '缺少视频URL参数'}, 400
+        ranges = parse_ranges(data.get('ranges'))
 
-    if not action:
-        return jsonify({'success': False, 'message': '缺少 action 参数'}), 400
+        record = get_video(video_url, progress=progress, **get_quality_options(data))
+        key = record['key']
+        video_path = store.file_path(record)
+        if not os.path.exists(video_path):
+            return {'error': '视频文件不存在，合并可能失败'}, 500
+
+        outputs = [os.path.join(DOWNLOAD_DIR, clip_filename(key, start, end, 'exact')) for start, end in ranges]
+        progress('encode', 0)
+        pin = storage.pin(key)
+        try:
+            storage.touch(video_path)
+            results = clip_cache.cut_many(key, video_path, ranges, outputs,
+                                          progress=lambda percent: progress('encode', percent))
+        except Exception as e:
+            return {'error': f'剪辑失败: {str(e)}'}, 500
+        finally:
+            storage.unpin(pin)
+            storage.check()
+        progress('encode', 100)
+
+        clips = []
+        for (start, end), (clip_path, hit) in zip(ranges, results):
+            storage.touch(clip_path)
+            clips.append({
+                'clip_id': catalog.segment_by_path(clip_path)['id'],
+                'start': start,
+                'end': end,
+                'video_url': f'/downloads/{os.path.basename(clip_path)}',
+                'cached': hit
+            })
+        return {'video_id': key, 'title': record['title'], 'clips': clips}, 200
 
-    # 自动查找 /downloads/ 目录下最新的 mp4 文件
-    mp4_files = glob.glob(os.path.join(DOWNLOAD_DIR, '*.mp4'))
-    if not mp4_files:
-        return jsonify({'success': False, 'message': '未找到可处理的视频文件'}), 404
+    except requests.RequestException as e:
+        return {'error': f'请求B站失败: {str(e)}'}, 502
+    except PageParseError as e:
+        return {'error': str(e), 'missing': e.missing}, 400
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        return {'error': f'服务器错误: {str(e)}'}, 500
 
-    # 取最后修改时间最新的文件
-    mp4_files.sort(key=os.path.getmtime, reverse=True)
-    local_path = mp4_files[0]
-    print(f"[自动选择] 最新视频文件: {local_path}")
 
+@app.route('/api/get_clips', methods=['POST'])
+def clips_api():
+    """批量剪辑：传入 url 和 ranges（[[开始, 结束], ...]，单位秒）"""
+    data = request.get_json()
+    if data.get('async'):
+        return submit_job('get_clips', run_get_clips, data)
+    payload, status = run_get_clips(data)
+    return jsonify(payload), status
+
+
+def check_batch_request(data):
+    """校验批量下载参数：urls 必须是链接列表，或给出 video_id"""
+    urls = data.get('urls')
+    if urls is not None and not isinstance(urls, list):
+        raise ValueError('urls 必须是链接列表')
+    if not urls and not data.get('video_id'):
+        raise ValueError('缺少 urls 或 video_id 参数')
+
+
+def run_batch_download(data, progress=no_progress):
+    """
+    批量下载视频
+    :param progress: 进度回调 progress(阶段, 百分比, 说明)
+    :return: (响应数据, HTTP状态码)
+    """
     try:
-        if action == 'vocal_remove':
-            output_audio_path = os.path.join(DOWNLOAD_DIR, 'vocal_removed.wav')
-            success = vocal_remove(local_path, output_audio_path)
-            return jsonify({
-                'success': success,
-                'message': f"伴奏提取 {'成功' if success else '失败'}",
-                'file_path': f'/downloads/{os.path.basename(output_audio_path)}'
-            })
+        check_batch_request(data)
+        urls = data.get('urls') or part_urls(data['video_id'], data.get('parts') or '1')
 
-        elif action == 'extract_subtitle':
-            output_srt_path = os.path.join(DOWNLOAD_DIR, 'subtitle.srt')
-            success = extract_subtitle(local_path, output_srt_path)
-            return jsonify({
-                'success': success,
-                'message': f"字幕提取 {'成功' if success else '失败'}",
-                'file_path': f'/downloads/{os.path.basename(output_srt_path)}'
-            })
+        results = get_videos(urls, progress=progress, **get_quality_options(data))
+        return {
+            'results': results,
+            'succeeded': sum(1 for r in results if r['status'] != 'failed'),
+            'failed': sum(1 for r in results if r['status'] == 'failed'),
+        }, 200
+
+    except requests.RequestException as e:
+        return {'error': f'请求B站失败: {str(e)}'}, 502
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        return {'error': f'服务器错误: {str(e)}'}, 500
 
-        elif action == 'enhance_audio':
-            output_video_path = os.path.join(DOWNLOAD_DIR, 'video_enhanced.mp4')
-            success = enhance_video_audio(local_path, output_video_path)
-            return jsonify({
-                'success': success,
-                'message': f"人声增强 {'成功' if success else '失败'}",
-                'file_path': f'/downloads/{os.path.basename(output_video_path)}'
-            })
 
-        else:
-            return jsonify({'success': False, 'message': '未知操作类型'}), 400
+@app.route('/api/batch_download', methods=['POST'])
+def batch_download():
+    """
+    批量下载：传入 urls 列表，或 video_id（BV号）加分P范围 parts（如 "1-40"）。
+    多个视频的下载时间很长，默认作为 batch 队列中的后台任务执行并立即返回任务ID，不占用交互任务的线程；
+    async 为 false 时同步返回结果
+    """
+    data = request.get_json() or {}
+    try:
+        check_batch_request(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if data.get('async', True):
+        return submit_job('batch_download', run_batch_download, data, queue='batch')
+    payload, status = run_batch_download(data)
+    return jsonify(payload), status
+
+
+def parse_actions(data):
+    """取出请求中的处理操作：actions 列表，或单个 action"""
+    actions = data.get('actions') or ([data['action']] if data.get('action') else [])
+    if not isinstance(actions, list):
+        raise ValueError('actions 必须是列表')
+    actions = list(dict.fromkeys(actions))
+    unknown = [action for action in actions if action not in ACTION_OUTPUTS]
+    if unknown:
+        raise ValueError(f"未知操作类型: {', '.join(map(str, unknown))}")
+    return actions
+
+
+def run_video_process(data, progress=no_progress):
+    """
+    对视频执行伴奏提取、字幕提取、人声增强中的一个或多个操作。
+    多个操作共用一次音频提取，各服务并发处理，全部完成后一起返回结果和各阶段耗时。
+    处理对象由 clip_id（片段ID，见 get_segments）、video_id（下载存储中的视频键）或 url 指定，
+    前两者直接从目录索引定位文件。
+    :param progress: 进度回调 progress(阶段, 百分比, 说明)
+    :return: (响应数据, HTTP状态码)
+    """
+    video_url = data.get('url')
+    video_id = data.get('video_id')
+    clip_id = data.get('clip_id')
+
+    try:
+        actions = parse_actions(data)
+    except ValueError as e:
+        return {'success': False, 'message': str(e)}, 400
+    if not actions:
+        return {'success': False, 'message': '缺少 action 参数'}, 400
+
+    if clip_id is not None:
+        try:
+            segment = catalog.get_segment(int(clip_id))
+        except (TypeError, ValueError):
+            return {'success': False, 'message': 'clip_id 必须是整数'}, 400
+        if not segment or not os.path.exists(segment['path']):
+            return {'success': False, 'message': '片段不存在'}, 404
+        local_path = segment['path']
+        pin = storage.pin(segment['video_key'])
+        print(f"[按片段选择] 处理文件: {local_path}")
+    elif video_id:
+        record = store.get(video_id)
+        if not record:
+            return {'success': False, 'message': '视频不存在'}, 404
+        local_path = store.file_path(record)
+        pin = storage.pin(video_id)
+        print(f"[按视频选择] 处理文件: {local_path}")
+    elif video_url:
+        # 给出视频链接时按链接获取；只需要音频的操作只下载音频流
+        try:
+            audio_only = all(action in AUDIO_ONLY_ACTIONS for action in actions)
+            record = get_video(video_url, audio_only=audio_only, progress=progress, **get_quality_options(data))
+        except Exception as e:
+            return {'success': False, 'message': f'获取视频失败: {str(e)}'}, 502
+        local_path = store.file_path(record)
+        pin = storage.pin(record['key'])
+        print(f"[按链接选择] 处理文件: {local_path}")
+    else:
+        return {'success': False, 'message': '缺少 clip_id、video_id 或 url 参数'}, 400
+
+    storage.touch(local_path)
+    try:
+        stem = os.path.splitext(os.path.basename(local_path))[0]
+        names = {action: f"{stem}_{ACTION_OUTPUTS[action][0]}" for action in actions}
+        outputs = {action: os.path.join(DOWNLOAD_DIR, names[action]) for action in actions}
+        succeeded, timings, transfers = process_video(local_path, outputs, progress)
+
+        results = {}
+        for action in actions:
+            success = succeeded.get(action, False)
+            name = ACTION_OUTPUTS[action][1]
+            results[action] = {
+                'success': success,
+                'message': f"{name} {'成功' if success else '失败'}",
+                'file_path': f'/downloads/{names[action]}',
+                'transfer': transfers.get(action)
+            }
+        payload = {
+            'success': all(result['success'] for result in results.values()),
+            'message': '，'.join(result['message'] for result in results.values()),
+            'results': results,
+            'timings': timings
+        }
+        if len(actions) == 1:
+            payload['file_path'] = results[actions[0]]['file_path']
+        return payload, 200
 
     except Exception as e:
-        return jsonify({'success': False, 'message': f'处理异常: {str(e)}'}), 500
+        return {'success': False, 'message': f'处理异常: {str(e)}'}, 500
+    finally:
+        storage.unpin(pin)
+        storage.check()
+
+
+@app.route('/api/video_process', methods=['POST'])
+def video_process():
+    data = request.get_json()
+    if data.get('async'):
+        try:
+            if not parse_actions(data):
+                return jsonify({'success': False, 'message': '缺少 action 参数'}), 400
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return submit_job('video_process', run_video_process, data)
+    payload, status = run_video_process(data)
+    return jsonify(payload), status
+
+
+@app.route('/api/clip_cache/stats', methods=['GET'])
+def clip_cache_stats():
+    """剪辑缓存的命中统计"""
+    return jsonify(clip_cache.stats())
+
+
+@app.route('/api/audio_cache/stats', methods=['GET'])
+def audio_cache_stats():
+    """提取音频缓存的命中统计和占用"""
+    return jsonify(audio_cache.stats())
+
+
+@app.route('/api/storage/stats', methods=['GET'])
+def storage_stats():
+    """下载目录的容量、水位、磁盘剩余空间和清理统计"""
+    return jsonify(storage.stats())
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """轮询任务状态和各阶段进度"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.snapshot())
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务进度，任务结束后关闭连接"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+
+    def stream():
+        version = -1
+        while True:
+            current = job.wait(version, JOB_HEARTBEAT)
+            if current == version:
+                # 没有新进度时发送注释行，防止代理断开空闲连接
+                yield ': keep-alive\n\n'
+                continue
+            version = current
+            snapshot = job.snapshot()
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            if snapshot['status'] in FINISHED:
+                break
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 if __name__ == '__main__':
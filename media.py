@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import mimetypes
+import os
+import uuid
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, parse_etags
+from werkzeug.wsgi import wrap_file
+
+# 交给前端代理发送文件：空为应用自己发送；x-accel 使用 Nginx 的 X-Accel-Redirect；x-sendfile 使用 Apache/Lighttpd 的 X-Sendfile
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD', '')
+# X-Accel-Redirect 的内部路径前缀，需在 Nginx 中配置为 internal 的 location 并指向下载目录
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-downloads/')
+# 浏览器缓存时间（秒），过期后用 ETag/Last-Modified 重新验证。
+# 默认 0 即 no-cache：处理结果等文件会以同一文件名重新生成，每次都要验证，未变化时只返回 304
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 0))
+# 不支持 sendfile 时每次读取的字节数
+MEDIA_READ_SIZE = 256 * 1024
+# 一个请求中最多接受的范围数，防止大量小范围拖慢服务
+MEDIA_MAX_RANGES = 16
+
+
+def parse_ranges(header, size):
+    """
+    解析 Range 请求头
+    :param header: 如 'bytes=0-99, 200-, -50'
+    :param size: 文件大小
+    :return: [(first, last), ...] 闭区间列表；请求头无法解析时为 None（按完整文件响应）；
+             所有范围都超出文件时为空列表（416）
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    ranges = []
+    for item in spec.split(','):
+        first, sep, last = item.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                first = int(first)
+                if last and int(last) < first:
+                    return None
+                last = min(int(last), size - 1) if last else size - 1
+            else:
+                # 后缀范围：最后 N 个字节
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                first, last = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+        if first < size:
+            ranges.append((first, last))
+    if len(ranges) > MEDIA_MAX_RANGES:
+        return None
+    return ranges
+
+
+def _etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _not_modified(etag, mtime):
+    """If-None-Match 优先于 If-Modified-Since"""
+    if request.headers.get('If-None-Match'):
+        return parse_etags(request.headers['If-None-Match']).contains_weak(etag.strip('"'))
+    since = parse_date(request.headers.get('If-Modified-Since'))
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _range_applies(etag, mtime):
+    """If-Range 与当前文件不一致时忽略 Range，返回完整文件"""
+    condition = request.headers.get('If-Range')
+    if not condition:
+        return True
+    if condition.startswith(('"', 'W/')):
+        return condition == etag
+    date = parse_date(condition)
+    return date is not None and int(mtime) == int(date.timestamp())
+
+
+def _file_part(path, first, length):
+    """逐块读取文件的一段"""
+    with open(path, 'rb') as f:
+        f.seek(first)
+        while length > 0:
+            data = f.read(min(MEDIA_READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _body(path, first, length, size):
+    """
+    文件片段的响应体。片段一直到文件末尾（完整文件或浏览器拖动进度条时的 bytes=N-）
+    且 WSGI 服务器提供 wsgi.file_wrapper 时（如 gunicorn）交给它，服务器从文件当前偏移起
+    用 sendfile 零拷贝发送；有的服务器会忽略 Content-Length 一直读到文件末尾，其余片段逐块读取。
+    """
+    if first + length == size and 'wsgi.file_wrapper' in request.environ:
+        f = open(path, 'rb')
+        f.seek(first)
+        return wrap_file(request.environ, f, MEDIA_READ_SIZE)
+    return _file_part(path, first, length)
+
+
+def _part_header(boundary, content_type, first, last, size):
+    return (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n").encode('latin-1')
+
+
+def _multipart(path, ranges, size, content_type, boundary):
+    for first, last in ranges:
+        yield _part_header(boundary, content_type, first, last, size)
+        yield from _file_part(path, first, last - first + 1)
+    yield f"\r\n--{boundary}--\r\n".encode('latin-1')
+
+
+def send_media(directory, filename):
+    """
+    发送下载目录中的媒体文件，支持 ETag/Last-Modified 条件请求、单范围和多范围 206 响应，
+    以及 X-Accel-Redirect/X-Sendfile 交由前端代理发送
+    :return: Response，文件不存在时为 None
+    """
+    path = os.path.join(directory, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    size = stat.st_size
+    etag = _etag(stat)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': f'public, max-age={MEDIA_MAX_AGE}' if MEDIA_MAX_AGE > 0 else 'no-cache',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(etag, stat.st_mtime):
+        return Response(status=304, headers=headers)
+
+    if MEDIA_OFFLOAD == 'x-accel':
+        # 代理自己处理 Range 和条件请求
+        headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + filename.replace(os.sep, '/')
+        return Response(status=200, headers=headers, content_type=content_type)
+    if MEDIA_OFFLOAD == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(status=200, headers=headers, content_type=content_type)
+
+    ranges = None
+    if request.headers.get('Range') and _range_applies(etag, stat.st_mtime):
+        ranges = parse_ranges(request.headers['Range'], size)
+
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return Response(_body(path, 0, size, size), status=200, headers=headers,
+                        content_type=content_type, direct_passthrough=True)
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        length = last - first + 1
+        headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+        headers['Content-Length'] = str(length)
+        return Response(_body(path, first, length, size), status=206, headers=headers,
+                        content_type=content_type, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    length = sum(len(_part_header(boundary, content_type, first, last, size)) + last - first + 1
+                 for first, last in ranges)
+    headers['Content-Length'] = str(length + len(f"\r\n--{boundary}--\r\n"))
+    return Response(_multipart(path, ranges, size, content_type, boundary), status=206, headers=headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
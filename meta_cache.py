@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# 元数据缓存有效期（秒），过期后重新抓取页面
+META_CACHE_TTL = int(os.environ.get('META_CACHE_TTL', 24 * 3600))
+# 最多缓存的条目数，超出后按最近最少使用淘汰
+META_CACHE_SIZE = int(os.environ.get('META_CACHE_SIZE', 512))
+# 流地址中没有 deadline 参数时假定的有效期（秒）
+STREAM_URL_TTL = 3600
+
+
+def url_expiry(url, default_ttl=STREAM_URL_TTL):
+    """从B站流地址的 deadline 参数中读取过期时间戳"""
+    deadline = parse_qs(urlparse(url).query).get('deadline', [''])[0]
+    if deadline.isdigit():
+        return int(deadline)
+    return int(time.time()) + default_ttl
+
+
+class MetaCache:
+    """
+    视频页面元数据缓存，按 (视频ID, 分P) 存储标题、播放信息和选中的流地址。
+    每个条目保存为目录下的一个 JSON 文件，重启后仍然有效，多个工作进程共享；
+    文件修改时间即最近访问时间，用于 LRU 淘汰。
+    """
+
+    def __init__(self, directory, ttl=META_CACHE_TTL, max_entries=META_CACHE_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # 按最近访问时间从旧到新排列的条目文件；只是本进程所见的顺序，
+        # 其他进程写入的条目不在其中，查询时从目录中读取
+        self.entries = OrderedDict()
+        files = [e for e in os.scandir(directory) if e.is_file() and e.name.endswith('.json')]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.entries[entry.name[:-len('.json')]] = entry.path
+
+    @staticmethod
+    def key(video_id, page):
+        return f"{video_id}_p{page}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, video_id, page):
+        """
+        查询缓存
+        :return: 条目字典，未命中或已过期时为 None
+        """
+        key = self.key(video_id, page)
+        with self.lock:
+            path = self.entries.get(key) or self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except FileNotFoundError:
+                self.entries.pop(key, None)
+                return None
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+
+            if time.time() - entry.get('cached_at', 0) > self.ttl:
+                self._remove(key)
+                return None
+
+            self.entries[key] = path
+            self.entries.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return entry
+
+    def put(self, video_id, page, title, playinfo, audio_url, video_url):
+        """写入或更新一个条目，并在超出容量时淘汰最久未使用的条目"""
+        key = self.key(video_id, page)
+        entry = {
+            'video_id': video_id,
+            'page': page,
+            'title': title,
+            'playinfo': playinfo,
+            'audio_url': audio_url,
+            'video_url': video_url,
+            'url_expires': min(url_expiry(audio_url), url_expiry(video_url)),
+            'cached_at': time.time(),
+        }
+        path = self._path(key)
+        with self.lock:
+            # 临时文件名带进程号，多个进程同时写入同一条目时互不干扰
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.entries[key] = path
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+        return entry
+
+    @staticmethod
+    def urls_valid(entry, margin=60):
+        """缓存的流地址是否仍在有效期内"""
+        return entry.get('url_expires', 0) - margin > time.time()
+
+    def _remove(self, key):
+        path = self.entries.pop(key, None) or self._path(key)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+# 探测时读取的字节数
+MIRROR_PROBE_BYTES = 256 * 1024
+# 每个CDN主机的测速结果保留时间（秒）
+MIRROR_RANK_TTL = int(os.environ.get('MIRROR_RANK_TTL', 600))
+# 传输速度低于预期的该比例时切换镜像
+MIRROR_SLOW_RATIO = float(os.environ.get('MIRROR_SLOW_RATIO', 0.3))
+# 传输开始后经过多久（秒）才开始判断是否变慢
+MIRROR_CHECK_AFTER = 1.0
+# 探测超时（秒）
+PROBE_TIMEOUT = (3, 5)
+
+
+def mirror_host(url):
+    return urlparse(url).netloc
+
+
+class MirrorSelector:
+    """
+    镜像测速与排名。用小范围 Range 请求测量各候选地址的首字节时间和吞吐，
+    结果按CDN主机缓存一段时间，下载过程中的实测速度也会更新它。
+    同时记录每个主机上正在传输的连接数：CDN 常按主机限速，多个连接分享测得的吞吐。
+    """
+
+    def __init__(self, ttl=MIRROR_RANK_TTL):
+        self.ttl = ttl
+        self.scores = {}
+        # 主机 -> 正在传输的连接数，所有流共享
+        self.active = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, url):
+        """登记一个正在从 url 所在主机传输的连接"""
+        host = mirror_host(url)
+        with self.lock:
+            self.active[host] = self.active.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active[host] -= 1
+                if not self.active[host]:
+                    del self.active[host]
+
+    def connections(self, url):
+        """url 所在主机上正在传输的连接数"""
+        with self.lock:
+            return self.active.get(mirror_host(url), 0)
+
+    def probe(self, url, headers):
+        """
+        测量一个地址
+        :return: {'ttfb': 首字节时间(秒), 'throughput': 吞吐(字节/秒), 'ok': 是否可用}
+        """
+        started = time.monotonic()
+        try:
+            with requests.get(url, headers={**headers, 'Range': f'bytes=0-{MIRROR_PROBE_BYTES - 1}'},
+                              stream=True, timeout=PROBE_TIMEOUT) as resp:
+                resp.raise_for_status()
+                received = 0
+                ttfb = None
+                for chunk in resp.iter_content(chunk_size=16 * 1024):
+                    if ttfb is None:
+                        ttfb = time.monotonic() - started
+                    received += len(chunk)
+            elapsed = time.monotonic() - started
+            transfer = max(elapsed - (ttfb or 0), 1e-6)
+            result = {'ttfb': ttfb or elapsed, 'throughput': received / transfer, 'ok': True}
+        except requests.RequestException:
+            result = {'ttfb': float('inf'), 'throughput': 0.0, 'ok': False}
+        result['measured_at'] = time.monotonic()
+        with self.lock:
+            self.scores[mirror_host(url)] = result
+        return result
+
+    def score(self, url):
+        """该地址所在主机的有效测速结果，过期或未测时为 None"""
+        with self.lock:
+            result = self.scores.get(mirror_host(url))
+        if result and time.monotonic() - result['measured_at'] < self.ttl:
+            return result
+        return None
+
+    def rank(self, urls, headers, chunk_size=4 * 1024 * 1024):
+        """
+        按预计获取一个分段所需时间（首字节时间 + 分段大小 / 吞吐）从快到慢排序，
+        已有测速结果的主机不再重复探测
+        """
+        urls = list(dict.fromkeys(u for u in urls if u))
+        if len(urls) <= 1:
+            return urls
+
+        unknown = [u for u in urls if self.score(u) is None]
+        if unknown:
+            with ThreadPoolExecutor(max_workers=len(unknown)) as pool:
+                list(pool.map(lambda u: self.probe(u, headers), unknown))
+
+        def expected_time(url):
+            result = self.score(url) or {'ok': False}
+            if not result['ok'] or result['throughput'] <= 0:
+                return float('inf')
+            return result['ttfb'] + chunk_size / result['throughput']
+
+        return sorted(urls, key=expected_time)
+
+    def record(self, url, received, seconds, connections=1):
+        """
+        用下载过程中的实测速度更新主机吞吐（指数滑动平均）
+        :param connections: 传输期间该主机上的连接数，单个连接的速度乘以它折算为主机的总吞吐
+        """
+        if seconds <= 0 or received <= 0:
+            return
+        with self.lock:
+            result = self.scores.get(mirror_host(url))
+            if result:
+                result['throughput'] = 0.7 * result['throughput'] + 0.3 * received / seconds * max(connections, 1)
+
+    def demote(self, url):
+        """标记主机不可用，直到测速结果过期"""
+        with self.lock:
+            self.scores[mirror_host(url)] = {'ttfb': float('inf'), 'throughput': 0.0, 'ok': False,
+                                             'measured_at': time.monotonic()}
+
+
+# 全局共享的镜像排名，按CDN主机记忆
+selector = MirrorSelector()
+
+
+class MirrorSet:
+    """一路流按排名排列的候选地址，当前地址变慢或出错时切换到下一个"""
+
+    def __init__(self, urls, ranker=None):
+        self.urls = list(urls)
+        self.ranker = ranker or selector
+        self.index = 0
+        self.lock = threading.Lock()
+
+    @property
+    def current(self):
+        return self.urls[self.index]
+
+    def has_fallback(self):
+        return self.index < len(self.urls) - 1
+
+    def expected_throughput(self, url):
+        """单个连接应得的吞吐：主机测得的吞吐由该主机上所有正在传输的连接分享"""
+        result = self.ranker.score(url)
+        if not result or not result['ok']:
+            return 0.0
+        return result['throughput'] / max(self.ranker.connections(url), 1)
+
+    def switch(self, bad_url):
+        """
+        放弃 bad_url，后续分段改用下一个镜像
+        :return: 是否还有可切换的镜像
+        """
+        with self.lock:
+            if self.urls[self.index] == bad_url and self.has_fallback():
+                self.ranker.demote(bad_url)
+                self.index += 1
+                print(f"镜像切换: {mirror_host(bad_url)} -> {mirror_host(self.current)}")
+            return self.urls[self.index] != bad_url
+
+
+# 本地替身服务器演示：三个限速不同的镜像，其中一个中途变慢
+if __name__ == "__main__":
+    import http.server
+    import re
+    import tempfile
+
+    # 以模块方式导入，与下载引擎共享同一个镜像排名
+    import mirrors
+    from downloader import download_streams
+
+    payload = os.urandom(8 * 1024 * 1024)
+
+    def make_handler(delay, slow_after=None):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            served = 0
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                first = int(match.group(1)) if match else 0
+                last = int(match.group(2)) if match and match.group(2) else len(payload) - 1
+                body = payload[first:last + 1]
+                self.send_response(206 if match else 200)
+                if match:
+                    self.send_header('Content-Range', f'bytes {first}-{last}/{len(payload)}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                for i in range(0, len(body), 64 * 1024):
+                    Handler.served += 1
+                    slow = slow_after is not None and Handler.served > slow_after
+                    time.sleep(delay * (100 if slow else 1))
+                    try:
+                        self.wfile.write(body[i:i + 64 * 1024])
+                    except (BrokenPipeError, ConnectionResetError):
+                        # 客户端切换镜像后主动断开
+                        return
+
+        return Handler
+
+    servers = []
+    for delay, slow_after in ((0.02, None), (0.001, 40), (0.005, None)):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), make_handler(delay, slow_after))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    urls = [f'http://127.0.0.1:{s.server_port}/stream.m4s' for s in servers]
+
+    print("镜像排名:", [mirror_host(u) for u in mirrors.selector.rank(urls, {}, 1024 * 1024)])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'stream.part')
+        stats = download_streams({'视频': (urls, path)}, {}, chunk_size=1024 * 1024)
+        with open(path, 'rb') as f:
+            print(stats['视频'], "内容一致" if f.read() == payload else "内容不一致")
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import codecs
+import html
+import json
+import re
+
+PLAYINFO_MARKER = 'window.__playinfo__='
+# 缓冲区末尾保留的字符数，防止标记被切在两个数据块之间
+TAIL_KEEP = 64
+
+H1_OPEN = re.compile(r'<h1[\s>]', re.IGNORECASE)
+H1_CLOSE = re.compile(r'</h1\s*>', re.IGNORECASE)
+SCRIPT_CLOSE = re.compile(r'</script\s*>', re.IGNORECASE)
+TITLE_ATTR = re.compile(r'\stitle="([^"]*)"')
+TAG = re.compile(r'<[^>]+>')
+
+
+class PageParseError(ValueError):
+    """页面中缺少标题或播放信息"""
+
+    FIELD_NAMES = {'title': '标题', 'playinfo': '播放信息'}
+
+    def __init__(self, missing, bytes_read):
+        self.missing = missing
+        self.bytes_read = bytes_read
+        names = '、'.join(self.FIELD_NAMES.get(m, m) for m in missing)
+        super().__init__(f"无法提取{names}（已读取 {bytes_read} 字节）")
+
+
+class PageInfoExtractor:
+    """
+    增量扫描视频页面，提取 <h1> 标题和 window.__playinfo__ JSON。
+    两者都拿到后 feed 返回 True，调用方即可停止读取响应体；
+    缓冲区只保留尚未闭合的片段，不保存整页内容。
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.buffer = ''
+        self.bytes_read = 0
+        self.title = None
+        self.playinfo = None
+
+    @property
+    def done(self):
+        return self.title is not None and self.playinfo is not None
+
+    def feed(self, chunk):
+        """
+        送入一块响应体字节
+        :return: 是否已拿到全部信息
+        """
+        self.bytes_read += len(chunk)
+        self.buffer += self.decoder.decode(chunk)
+
+        # 尚未闭合的标记起点，缓冲区需从这里开始保留
+        pending = []
+        if self.playinfo is None:
+            pending.append(self._scan_playinfo())
+        if self.title is None:
+            pending.append(self._scan_title())
+
+        if self.done:
+            self.buffer = ''
+        else:
+            starts = [p for p in pending if p is not None]
+            keep = min(starts) if starts else max(len(self.buffer) - TAIL_KEEP, 0)
+            self.buffer = self.buffer[keep:]
+        return self.done
+
+    def _scan_playinfo(self):
+        start = self.buffer.find(PLAYINFO_MARKER)
+        if start < 0:
+            return None
+        close = SCRIPT_CLOSE.search(self.buffer, start)
+        if not close:
+            return start
+        text = self.buffer[start + len(PLAYINFO_MARKER):close.start()].strip().rstrip(';')
+        try:
+            self.playinfo = json.loads(text)
+        except ValueError:
+            raise PageParseError(['playinfo'], self.bytes_read)
+        return None
+
+    def _scan_title(self):
+        pos = 0
+        while True:
+            opening = H1_OPEN.search(self.buffer, pos)
+            if not opening:
+                return None
+            tag_end = self.buffer.find('>', opening.start())
+            close = H1_CLOSE.search(self.buffer, tag_end + 1) if tag_end >= 0 else None
+            if not close:
+                return opening.start()
+
+            title = html.unescape(TAG.sub('', self.buffer[tag_end + 1:close.start()])).strip()
+            if not title:
+                # 标题文字为空时使用 title 属性
+                attr = TITLE_ATTR.search(self.buffer, opening.start(), tag_end)
+                title = html.unescape(attr.group(1)).strip() if attr else ''
+            if title:
+                self.title = title
+                return None
+            # 空标题的 <h1>，继续查找后面的
+            pos = close.end()
+
+    def result(self):
+        """
+        :return: (标题, 播放信息JSON)
+        :raises PageParseError: 缺少任一项时
+        """
+        missing = [name for name, value in (('title', self.title), ('playinfo', self.playinfo)) if value is None]
+        if missing:
+            raise PageParseError(missing, self.bytes_read)
+        return self.title, self.playinfo
+
+
+def extract_page_info(chunks):
+    """从响应体数据块中提取标题和播放信息，拿到后立即停止读取"""
+    extractor = PageInfoExtractor()
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    return extractor.result()
+
+
+# 微基准：对比整页解码加正则扫描与流式提取的耗时和内存峰值
+# 用法: python page_info.py 保存的页面1.html [页面2.html ...]，不给文件时使用合成页面
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    def regex_extract(raw):
+        text = raw.decode('utf-8')
+        title = re.search(r'<h1[^>]*>(.*?)</h1>', text, re.DOTALL).group(1).strip()
+        playinfo = json.loads(re.search(r'<script>window.__playinfo__=(.*?)</script>', text, re.DOTALL).group(1))
+        return title, playinfo
+
+    def stream_extract(raw, chunk_size=64 * 1024):
+        return extract_page_info(raw[i:i + chunk_size] for i in range(0, len(raw), chunk_size))
+
+    def synthetic_page():
+        playinfo = {'data': {'dash': {'duration': 600, 'video': [{'id': 80, 'baseUrl': 'https://cdn/v' * 20}] * 8,
+                                      'audio': [{'id': 30280, 'baseUrl': 'https://cdn/a' * 20}] * 3}}}
+        head = '<html><head>' + '<script>var x = "' + 'a' * 120000 + '";</script>'
+        head += f'<script>{PLAYINFO_MARKER}{json.dumps(playinfo)}</script></head><body>'
+        body = '<div class="video-info"><h1 title="示例" class="video-title">示例 &amp; 标题</h1></div>'
+        tail = '<script>window.__INITIAL_STATE__=' + json.dumps({'list': ['x' * 100] * 4000}) + '</script></body></html>'
+        return (head + body + tail).encode('utf-8')
+
+    fixtures = [(path, open(path, 'rb').read()) for path in sys.argv[1:]] or [('合成页面', synthetic_page())]
+    for name, raw in fixtures:
+        print(f"{name}: {len(raw) / 1024:.0f} KB")
+        assert regex_extract(raw)[1] == stream_extract(raw)[1]
+        for label, func in (('正则整页扫描', regex_extract), ('流式提取', stream_extract)):
+            rounds = 20
+            started = time.perf_counter()
+            for _ in range(rounds):
+                func(raw)
+            elapsed = (time.perf_counter() - started) / rounds
+
+            tracemalloc.start()
+            func(raw)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label}: {elapsed * 1000:.2f} ms, 内存峰值 {peak / 1024:.0f} KB")
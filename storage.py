@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# 下载目录的容量上限（字节）
+STORAGE_QUOTA = int(os.environ.get('STORAGE_QUOTA', 20 * 1024 ** 3))
+# 占用超过上限的该比例时开始清理，清理到低于低水位为止
+STORAGE_HIGH_WATERMARK = float(os.environ.get('STORAGE_HIGH_WATERMARK', 0.9))
+STORAGE_LOW_WATERMARK = float(os.environ.get('STORAGE_LOW_WATERMARK', 0.7))
+# 磁盘剩余空间低于该值（字节）时同样开始清理，即使下载目录未超过上限
+STORAGE_MIN_FREE = int(os.environ.get('STORAGE_MIN_FREE', 1024 ** 3))
+# 后台检查的间隔（秒）
+STORAGE_SWEEP_INTERVAL = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 60))
+# 最近修改过的文件可能仍在写入（下载、合并、剪辑中），不清理
+STORAGE_GRACE = 600
+# 会话无操作超过该时间（秒）后不再占用文件，放弃的会话由此失效
+STORAGE_SESSION_TTL = int(os.environ.get('STORAGE_SESSION_TTL', 4 * 3600))
+# 任务占用的最长时间，进程异常退出时占用到期自动失效
+STORAGE_JOB_TTL = 24 * 3600
+# 同一文件两次记录访问时间的最小间隔（秒），避免拖动进度条时的每个 Range 请求都写一次
+TOUCH_INTERVAL = 60
+
+
+class StorageManager:
+    """
+    下载目录的容量管理。占用超过高水位或磁盘剩余空间不足时，按最近访问时间从旧到新删除文件，
+    直到降到低水位；被正在运行的任务或打开的会话占用的视频及其片段不删除。
+    访问时间记录在文件的 atime 中（修改时间保持不变，不影响 ETag 和剪辑缓存键），多个进程共享。
+    """
+
+    def __init__(self, directory, catalog):
+        self.directory = directory
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.last_sweep = None
+
+    def start(self):
+        """启动后台清理线程"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name='storage-sweep', daemon=True)
+            self.thread.start()
+
+    def check(self):
+        """请求后台线程立即检查一次，新文件写入后调用"""
+        self.wake.set()
+
+    def _loop(self):
+        while True:
+            self.wake.wait(STORAGE_SWEEP_INTERVAL)
+            self.wake.clear()
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"容量清理失败: {str(e)}")
+
+    def touch(self, path):
+        """记录文件被访问（下载、播放或处理）"""
+        try:
+            stat = os.stat(path)
+            now = time.time_ns()
+            if now - stat.st_atime_ns >= TOUCH_INTERVAL * 10 ** 9:
+                os.utime(path, ns=(now, stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    def pin(self, target, ttl=STORAGE_JOB_TTL):
+        """
+        任务开始时占用视频或文件，结束时用返回的占用者调用 unpin
+        :param target: 视频键（占用该视频及其片段）或文件路径
+        :return: 占用者标识
+        """
+        owner = f"job:{uuid.uuid4().hex}"
+        self.catalog.pin(owner, target, time.time() + ttl)
+        return owner
+
+    def unpin(self, owner):
+        self.catalog.unpin(owner)
+
+    def open_session(self, key):
+        """用户打开或继续操作某个视频，占用到会话过期或 close_session"""
+        self.catalog.pin(f"session:{key}", key, time.time() + STORAGE_SESSION_TTL)
+
+    def close_session(self, key):
+        self.catalog.unpin(f"session:{key}")
+
+    def _files(self):
+        """目录中的文件：[(路径, 大小, 最近访问时间, 修改时间), ...]"""
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files.append((entry.path, stat.st_size, max(stat.st_atime, stat.st_mtime), stat.st_mtime))
+        return files
+
+    def _forget(self, path, videos, segments):
+        """删除文件后清除对应的索引记录"""
+        name = os.path.basename(path)
+        if name in videos:
+            self.catalog.remove_video(videos[name])
+            self.catalog.remove_urls(videos[name])
+        if path in segments:
+            self.catalog.remove_segment(path)
+
+    def sweep(self):
+        """
+        检查容量，超过高水位或磁盘空间不足时清理
+        :return: 本次删除的文件数
+        """
+        with self.lock:
+            files = self._files()
+            used = sum(size for _, size, _, _ in files)
+            free = shutil.disk_usage(self.directory).free
+            self.last_sweep = time.time()
+            if used <= STORAGE_QUOTA * STORAGE_HIGH_WATERMARK and free >= STORAGE_MIN_FREE:
+                return 0
+
+            need = max(used - STORAGE_QUOTA * STORAGE_LOW_WATERMARK, STORAGE_MIN_FREE - free)
+            pinned = self.catalog.pinned()
+            videos = self.catalog.video_files()
+            segments = self.catalog.segment_files()
+            recent = time.time() - STORAGE_GRACE
+
+            evicted = 0
+            for path, size, accessed, modified in sorted(files, key=lambda f: f[2]):
+                if need <= 0:
+                    break
+                owner = videos.get(os.path.basename(path)) or segments.get(path)
+                if modified > recent or path in pinned or owner in pinned:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # 其他进程已经删除
+                    pass
+                except OSError as e:
+                    print(f"删除文件失败: {path} {str(e)}")
+                    continue
+                self._forget(path, videos, segments)
+                print(f"容量清理删除: {path}")
+                need -= size
+                evicted += 1
+                self.evictions += 1
+                self.evicted_bytes += size
+            return evicted
+
+    def stats(self):
+        files = self._files()
+        usage = shutil.disk_usage(self.directory)
+        return {
+            'quota': STORAGE_QUOTA,
+            'used': sum(size for _, size, _, _ in files),
+            'files': len(files),
+            'high_watermark': int(STORAGE_QUOTA * STORAGE_HIGH_WATERMARK),
+            'low_watermark': int(STORAGE_QUOTA * STORAGE_LOW_WATERMARK),
+            'disk_free': usage.free,
+            'disk_total': usage.total,
+            'pinned': len(self.catalog.pinned()),
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes,
+            'last_sweep': self.last_sweep,
+        }
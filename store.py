@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import time
+
+
+class DownloadStore:
+    """
+    下载目录中的视频存储。文件按 (视频ID, 分P, 清晰度) 命名，
+    目录索引（Catalog）的 videos 表记录每个文件对应的标题和大小，标题只用于展示，不参与定位。
+    只下载了音频的条目 kind 为 audio，文件扩展名为 m4a。
+    """
+    # 旧版本使用的 JSON 索引，首次启动时导入目录索引后删除，不留在对外提供的下载目录中
+    LEGACY_INDEX_NAME = 'index.json'
+
+    def __init__(self, directory, catalog):
+        self.directory = directory
+        self.catalog = catalog
+        os.makedirs(directory, exist_ok=True)
+        self._import_legacy_index()
+
+    def _import_legacy_index(self):
+        legacy_path = os.path.join(self.directory, self.LEGACY_INDEX_NAME)
+        # 之前的版本导入后改名保留的旧索引
+        try:
+            os.remove(legacy_path + '.imported')
+        except OSError:
+            pass
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return
+        for record in records.values():
+            if not self.catalog.get_video(record['key']):
+                self.catalog.put_video(record)
+        os.remove(legacy_path)
+
+    @staticmethod
+    def key(video_id, page, quality):
+        return f"{video_id}_p{page}_q{quality}"
+
+    def path(self, key, ext='mp4'):
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def file_path(self, record):
+        return os.path.join(self.directory, record['filename'])
+
+    def get(self, key):
+        """按键查询记录，文件已不存在时删除记录并返回 None"""
+        record = self.catalog.get_video(key)
+        if record and not os.path.exists(self.file_path(record)):
+            self.catalog.remove_video(key)
+            return None
+        return record
+
+    def find(self, video_id, page, kinds=('video',)):
+        """查询某个视频分P已下载的任一清晰度，kinds 按优先级给出可接受的类型"""
+        candidates = [r for r in self.catalog.find_videos(video_id, page) if r.get('kind', 'video') in kinds]
+        candidates.sort(key=lambda r: kinds.index(r.get('kind', 'video')))
+        for candidate in candidates:
+            record = self.get(candidate['key'])
+            if record:
+                return record
+        return None
+
+    def add(self, video_id, page, quality, title, kind='video'):
+        """登记一个已写入 path(key) 的文件"""
+        key = self.key(video_id, page, quality)
+        path = self.path(key, 'm4a' if kind == 'audio' else 'mp4')
+        record = {
+            'key': key,
+            'video_id': video_id,
+            'page': page,
+            'quality': quality,
+            'kind': kind,
+            'title': title,
+            'filename': os.path.basename(path),
+            'size': os.path.getsize(path),
+            'created': time.time(),
+        }
+        self.catalog.put_video(record)
+        return record
+
+    def remove(self, key):
+        """
+        删除视频文件、由它剪辑出的片段以及记录
+        :return: 删除的文件路径列表
+        """
+        removed = []
+        record = self.catalog.get_video(key)
+        paths = glob.glob(os.path.join(self.directory, f"{glob.escape(key)}_*.mp4"))
+        if record:
+            paths.insert(0, self.file_path(record))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+        self.catalog.remove_video(key)
+        return removed
@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 计算内容指纹时从源文件开头、中间、结尾各读取的字节数
+FINGERPRINT_SAMPLE = 1024 * 1024
+
+
+class AudioCache:
+    """
+    提取音频的磁盘缓存
+
+    键由源文件的内容指纹（大小和首、中、尾三段内容的哈希）与输出格式（格式、采样率、声道数）组成，
+    源文件内容变化后指纹随之变化，旧条目不再命中并最终被淘汰。
+    总大小超过上限时按最近使用时间（缓存文件的 mtime，命中时更新）从旧到新删除。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # 源文件路径 -> (大小, mtime_ns, 指纹)，文件未变化时不必重新读取
+        self.fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def fingerprint(self, path):
+        """源文件的快速内容指纹"""
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self.fingerprints.get(path)
+        if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+
+        digest = hashlib.sha1(str(stat.st_size).encode())
+        with open(path, 'rb') as f:
+            for offset in (0, max(stat.st_size // 2 - FINGERPRINT_SAMPLE // 2, 0),
+                           max(stat.st_size - FINGERPRINT_SAMPLE, 0)):
+                f.seek(offset)
+                digest.update(f.read(FINGERPRINT_SAMPLE))
+        value = digest.hexdigest()
+        self.fingerprints[path] = (stat.st_size, stat.st_mtime_ns, value)
+        return value
+
+    def get(self, source, audio_format, sample_rate, channels, build):
+        """
+        返回缓存的音频，未命中时调用 build 生成
+
+        参数:
+            source (str): 源音视频文件路径
+            audio_format (str): 输出格式（文件扩展名），如 wav、flac
+            sample_rate (int): 采样率
+            channels (int): 声道数
+            build (callable): build(输出路径) -> bool，把音频写到给定路径
+
+        返回:
+            str: 缓存中的音频路径，生成失败时为 None
+        """
+        identity = f"{self.fingerprint(source)}|{audio_format}|{sample_rate}|{channels}"
+        key = hashlib.sha1(identity.encode()).hexdigest()
+        path = os.path.join(self.directory, f"{key}.{audio_format}")
+
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+                with self.lock:
+                    self.hits += 1
+                logger.info(f"音频缓存命中: {path}")
+                return path
+            except FileNotFoundError:
+                # 刚被其他进程淘汰
+                pass
+
+        with self.lock:
+            self.misses += 1
+        # 先写到唯一的临时文件再改名，并发生成同一条目时互不干扰，也不会读到写了一半的文件
+        tmp_path = os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.tmp.{audio_format}")
+        try:
+            if not build(tmp_path) or not os.path.exists(tmp_path):
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        """总大小超过上限时删除最久未使用的条目"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.path == keep or '.tmp.' in entry.name:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        try:
+            total += os.path.getsize(keep)
+        except OSError:
+            pass
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                logger.info(f"音频缓存淘汰: {path}")
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self):
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory)
+                 if entry.is_file() and '.tmp.' not in entry.name]
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'entries': len(sizes),
+                'bytes': sum(sizes),
+                'max_bytes': self.max_bytes,
+            }
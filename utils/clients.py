@@ -7,39 +7,149 @@ import logging
 import subprocess
 import tempfile
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from utils.audio_cache import AudioCache
+    from utils.transfer import call_service, SERVICE_SPOOL_DIR
+except ImportError:
+    # 在 utils 目录下直接运行本文件测试时
+    from audio_cache import AudioCache
+    from transfer import call_service, SERVICE_SPOOL_DIR
+
+logger = logging.getLogger(__name__)
+
+# 处理流水线支持的操作
+ACTIONS = ('vocal_remove', 'extract_subtitle', 'enhance_audio')
+
+# 各服务公布音频规格的端点
+PROFILE_URLS = {
+    'extract_subtitle': "http://localhost:9091/profile",
+    'enhance_audio': "http://localhost:9092/profile",
+    'vocal_remove': "http://localhost:9093/profile",
+}
+# 服务公布规格之前各服务使用的音频规格
+DEFAULT_AUDIO_PROFILE = {'format': 'wav', 'sample_rate': 44100, 'channels': 2}
+# 服务没有 /profile 时使用的音频规格；None 表示服务接受任意音频：
+# 复用同一次处理中已按其他服务规格提取的音频，没有时按 DEFAULT_AUDIO_PROFILE 提取
+DEFAULT_PROFILES = {
+    'extract_subtitle': None,
+    'enhance_audio': DEFAULT_AUDIO_PROFILE,
+    'vocal_remove': DEFAULT_AUDIO_PROFILE,
+}
+
+
+# 提取音频的缓存目录和总大小上限（字节）。
+# 配置了共享暂存目录时默认放在其中，交接给服务时可以硬链接，不复制
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR') or os.path.join(
+    SERVICE_SPOOL_DIR or tempfile.gettempdir(), 'audio_cache')
+AUDIO_CACHE_SIZE = int(os.environ.get('AUDIO_CACHE_SIZE', 5 * 1024 ** 3))
+
+# 输出格式 -> ffmpeg 音频编码器。opus 只支持 48000/24000/16000/12000/8000 采样率
+AUDIO_CODECS = {
+    'wav': 'pcm_s16le',
+    'flac': 'flac',
+    'opus': 'libopus',
+}
+# 输出格式 -> 上传时的 Content-Type
+AUDIO_CONTENT_TYPES = {
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'opus': 'audio/ogg',
+}
+
+# 同一视频再次处理时直接使用已提取的音频，不再解码
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_SIZE)
+
+# 操作 -> 服务公布的音频规格，服务进程不重启时规格不变，只查询一次
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def service_profile(action):
+    """
+    读取服务需要的音频规格，按该规格提取音频，服务端不必再重采样、混缩声道
 
+    参数:
+        action (str): 操作，取值见 ACTIONS
 
-
-def extract_audio_from_video(video_path, output_audio_format="wav"):
+    返回:
+        dict: {'format', 'sample_rate', 'channels'}；服务未公布规格时为 DEFAULT_PROFILES 中的值，None 表示接受任意音频
     """
-    从视频中提取音频
+    with _profiles_lock:
+        if action in _profiles:
+            return _profiles[action]
+
+    profile = DEFAULT_PROFILES[action]
+    try:
+        response = requests.get(PROFILE_URLS[action], timeout=5)
+    except requests.exceptions.RequestException as e:
+        # 服务暂不可用，不缓存，下次再查询
+        logger.warning(f"读取音频规格失败，使用默认规格: {str(e)}")
+        return profile
+
+    if response.status_code == 200:
+        try:
+            advertised = response.json()
+            if advertised['format'] not in AUDIO_CODECS:
+                raise ValueError(f"不支持的格式 {advertised['format']}")
+            profile = {
+                'format': advertised['format'],
+                'sample_rate': int(advertised['sample_rate']),
+                'channels': int(advertised['channels']),
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"音频规格无效，使用默认规格: {str(e)}")
+
+    with _profiles_lock:
+        _profiles[action] = profile
+    logger.info(f"{action} 音频规格: {profile}")
+    return profile
+
+
+def _content_type(path):
+    return AUDIO_CONTENT_TYPES.get(os.path.splitext(path)[1][1:].lower(), 'application/octet-stream')
+
+
+def extract_audio_from_video(video_path, output_audio_format="wav", sample_rate=44100, channels=2):
     """
-    # 创建临时目录
-    temp_dir = tempfile.mkdtemp()
-    audio_path = os.path.join(temp_dir, f"original_audio.{output_audio_format}")
+    从视频中提取音频，结果保存在音频缓存中，同一视频以相同格式再次提取时直接返回
 
-    # 使用FFmpeg提取音频
-    cmd = [
-        "ffmpeg",
-        "-i", video_path,
-        "-vn",  # 禁用视频流
-        "-acodec", "pcm_s16le",  # WAV格式
-        "-ar", "44100",  # 采样率
-        "-ac", "2",  # 声道
-        "-y",  # 覆盖输出
-        audio_path
-    ]
+    返回:
+    str: 缓存中的音频路径，由缓存管理，调用方不要删除；失败时为 None
+    """
+    def build(audio_path):
+        # 使用FFmpeg提取音频
+        cmd = [
+            "ffmpeg",
+            "-i", video_path,
+            "-vn",  # 禁用视频流
+            "-acodec", AUDIO_CODECS[output_audio_format],
+            "-ar", str(sample_rate),  # 采样率
+            "-ac", str(channels),  # 声道
+            "-y",  # 覆盖输出
+            audio_path
+        ]
+
+        logger.info(f"提取音频: {' '.join(cmd)}")
+        result = subprocess.run(cmd, capture_output=True, text=True)
+
+        if result.returncode != 0:
+            logger.error(f"音频提取失败: {result.stderr}")
+            return False
+        return True
 
-    logger.info(f"提取音频: {' '.join(cmd)}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    audio_path = audio_cache.get(video_path, output_audio_format, sample_rate, channels, build)
+    if audio_path:
+        logger.info(f"音频提取成功: {audio_path}")
+    return audio_path
 
-    if result.returncode != 0:
-        logger.error(f"音频提取失败: {result.stderr}")
-        shutil.rmtree(temp_dir)
-        return None, None
 
-    logger.info(f"音频提取成功: {audio_path}")
-    return audio_path, temp_dir
+def extract_audio_for(video_path, profile):
+    """按 service_profile 返回的规格提取音频；profile 为 None 时按 DEFAULT_AUDIO_PROFILE 提取"""
+    profile = profile or DEFAULT_AUDIO_PROFILE
+    return extract_audio_from_video(video_path, profile['format'], profile['sample_rate'], profile['channels'])
 
 
 def combine_audio_video(video_path: str, audio_path: str, output_video_path: str) -> bool:
@@ -80,6 +190,56 @@ def combine_audio_video(video_path: str, audio_path: str, output_video_path: str
     return True
 
 
+def _check_enhance_service():
+    try:
+        requests.get("http://localhost:9092", timeout=5)
+    except requests.exceptions.ConnectionError:
+        logger.error("音频增强服务未启动！请先运行语音增强微服务")
+        return False
+    return True
+
+
+def _enhance_step(audio_path, video_path, output_video_path, output_format="wav", transfer=None):
+    """
+    把已提取的音频发送到增强服务，再与原始视频合成
+    transfer (dict): 给出时写入本次调用的传输统计
+    """
+    # 服务端点
+    url = "http://localhost:9092/enhance"
+
+    # 创建临时工作目录
+    work_dir = tempfile.mkdtemp()
+    logger.info(f"创建临时工作目录: {work_dir}")
+    try:
+        # 发送音频到增强服务，增强后的音频逐块写入文件
+        logger.info(f"发送音频到增强服务: {audio_path}")
+        enhanced_audio_path = os.path.join(work_dir, f"enhanced_audio.{output_format}")
+        response, stats = call_service(url, audio_path, content_type=_content_type(audio_path),
+                                       params={'output_format': output_format}, output_path=enhanced_audio_path)
+        if transfer is not None:
+            transfer.update(stats.as_dict())
+
+        if response.status_code != 200:
+            logger.error(f"音频增强失败: HTTP {response.status_code} - {response.text}")
+            return False
+
+        logger.info(f"音频增强成功! {stats}")
+        logger.info(f"增强音频保存到: {enhanced_audio_path}")
+
+        # 合并增强后的音频和原始视频
+        logger.info(f"合并增强音频与原始视频")
+
+        # 调用抽象后的合成函数
+        return combine_audio_video(
+            video_path=video_path,
+            audio_path=enhanced_audio_path,
+            output_video_path=output_video_path
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        logger.info(f"清理工作临时目录: {work_dir}")
+
+
 def enhance_video_audio(video_path, output_video_path, output_format="wav"):
     """
     增强视频中的音频并重新合成视频
@@ -92,76 +252,78 @@ def enhance_video_audio(video_path, output_video_path, output_format="wav"):
     返回:
     bool: 处理是否成功
     """
-    # 服务端点
-    url = "http://localhost:9092/enhance"
-
     # 确保服务正在运行
-    try:
-        requests.get("http://localhost:9092", timeout=5)
-    except requests.exceptions.ConnectionError:
-        logger.error("音频增强服务未启动！请先运行语音增强微服务")
+    if not _check_enhance_service():
         return False
 
-    # 创建临时工作目录
-    work_dir = tempfile.mkdtemp()
-    logger.info(f"创建临时工作目录: {work_dir}")
-
-    audio_temp_dir = None
     try:
-        # 1. 从视频中提取音频
+        # 1. 按增强服务的音频规格从视频中提取音频
         logger.info(f"处理视频文件: {video_path}")
-        audio_path, audio_temp_dir = extract_audio_from_video(video_path)
+        audio_path = extract_audio_for(video_path, service_profile('enhance_audio'))
         if not audio_path:
             return False
 
-        # 2. 发送音频到增强服务
-        logger.info(f"发送音频到增强服务: {audio_path}")
-        with open(audio_path, "rb") as f:
-            files = {'audio_file': (os.path.basename(audio_path), f, "audio/wav")}
-            params = {'output_format': output_format}
+        # 2. 发送音频到增强服务并与原始视频合成
+        return _enhance_step(audio_path, video_path, output_video_path, output_format)
 
-            start_time = time.time()
-            response = requests.post(url, files=files, params=params)
-            elapsed = time.time() - start_time
+    except Exception as e:
+        logger.error(f"处理失败: {str(e)}")
+        return False
 
-            if response.status_code != 200:
-                logger.error(f"音频增强失败: HTTP {response.status_code} - {response.text}")
-                return False
 
-            logger.info(f"音频增强成功! 处理时间: {elapsed:.2f}秒")
+def _check_subtitle_service():
+    try:
+        health_res = requests.get("http://localhost:9091/health")
+        if health_res.status_code != 200:
+            logger.error(f"服务健康检查失败: HTTP {health_res.status_code}")
+            return False
+        logger.info("服务健康检查成功")
+    except requests.exceptions.ConnectionError:
+        logger.error("服务未启动！请先运行FastAPI服务")
+        return False
+    return True
 
-            # 保存增强后的音频
-            enhanced_audio_path = os.path.join(work_dir, f"enhanced_audio.{output_format}")
-            with open(enhanced_audio_path, "wb") as f:
-                f.write(response.content)
-            logger.info(f"增强音频保存到: {enhanced_audio_path}")
 
-        # 3. 合并增强后的音频和原始视频
-        logger.info(f"合并增强音频与原始视频")
+def _subtitle_step(file_path, output_path, transfer=None):
+    """
+    上传音视频文件到字幕提取服务，把返回的字幕写入 output_path
+    transfer (dict): 给出时写入本次调用的传输统计
+    """
+    # 服务端点
+    url = "http://localhost:9091/extract"
 
-        # 调用抽象后的合成函数
-        if not combine_audio_video(
-                video_path=video_path,
-                audio_path=enhanced_audio_path,
-                output_video_path=output_video_path
-        ):
-            return False
+    return_type = "text"
+    # 请求参数
+    params = {
+        'return_type': return_type,
+        'output_filename': os.path.basename(output_path) if output_path else None
+    }
+
+    logger.info(f"上传文件: {os.path.basename(file_path)} (大小: {os.path.getsize(file_path)} 字节)")
+    logger.info(f"请求参数: return_type={return_type}, output_filename={params['output_filename']}")
+
+    # 发送请求，文件逐块上传
+    response, stats = call_service(url, file_path, params=params)
+    if transfer is not None:
+        transfer.update(stats.as_dict())
+
+    # 处理响应
+    if response.status_code != 200:
+        logger.error(f"请求失败: HTTP {response.status_code} - {response.text}")
+        return False
 
-        return True
+    logger.info(f"请求成功! {stats}")
 
-    except Exception as e:
-        logger.error(f"处理失败: {str(e)}")
-        return False
-    finally:
-        # 清理临时目录
-        if audio_temp_dir:
-            shutil.rmtree(audio_temp_dir, ignore_errors=True)
-            logger.info(f"清理音频临时目录: {audio_temp_dir}")
+    # 文本响应
+    result = response.json()
+    logger.info(f"返回文本内容: {len(result['content'])} 字符")
+    logger.debug(f"前100个字符: {result['content'][:100]}")
 
-        if work_dir and os.path.exists(work_dir):
-            shutil.rmtree(work_dir, ignore_errors=True)
-            logger.info(f"清理工作临时目录: {work_dir}")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(result["content"])
+    logger.info(f"字幕保存到: {output_path}")
 
+    return True
 
 
 def extract_subtitle(
@@ -178,66 +340,65 @@ def extract_subtitle(
     返回:
     bool: 处理是否成功
     """
-    # 服务端点
-    url = "http://localhost:9091/extract"
-
     # 确保服务正在运行
-    try:
-        health_res = requests.get("http://localhost:9091/health")
-        if health_res.status_code != 200:
-            logger.error(f"服务健康检查失败: HTTP {health_res.status_code}")
-            return False
-        logger.info("服务健康检查成功")
-    except requests.exceptions.ConnectionError:
-        logger.error("服务未启动！请先运行FastAPI服务")
+    if not _check_subtitle_service():
         return False
 
-    return_type = "text"
     try:
-        # 准备文件上传
-        filename = os.path.basename(file_path)
-        files = {'audio_file': (filename, open(file_path, 'rb'))}
-
-        # 请求参数
-        params = {
-            'return_type': return_type,
-            'output_filename': os.path.basename(output_path) if output_path else None
-        }
+        # 只发送提取的音频，不发送整个文件
+        audio_path = extract_audio_for(file_path, service_profile('extract_subtitle'))
+        if not audio_path:
+            return False
+        return _subtitle_step(audio_path, output_path)
+    except Exception as e:
+        logger.error(f"测试失败: {str(e)}")
+        return False
 
-        logger.info(f"上传文件: {filename} (大小: {os.path.getsize(file_path)} 字节)")
-        logger.info(f"请求参数: return_type={return_type}, output_filename={params['output_filename']}")
 
-        # 发送请求
-        start_time = time.time()
-        response = requests.post(url, files=files, params=params)
-        elapsed = time.time() - start_time
+def _check_vocal_remove_service():
+    try:
+        # 验证服务是否可用
+        health_check = requests.get("http://localhost:9093", timeout=5)
+        if health_check.status_code != 200:
+            logger.warning(f"伴奏提取服务响应异常: HTTP {health_check.status_code}")
+    except requests.exceptions.ConnectionError:
+        logger.error("伴奏提取服务未启动！请先运行伴奏提取微服务(端口9093)")
+        return False
+    except Exception as e:
+        logger.error(f"服务检查失败: {str(e)}")
+        return False
+    return True
 
-        # 处理响应
-        if response.status_code != 200:
-            logger.error(f"请求失败: HTTP {response.status_code} - {response.text}")
-            return False
 
-        logger.info(f"请求成功! 耗时: {elapsed:.2f}秒")
+def _vocal_remove_step(audio_path, output_audio_path, output_format="wav", transfer=None):
+    """
+    把已提取的音频发送到伴奏提取服务，返回的伴奏逐块写入 output_audio_path
+    transfer (dict): 给出时写入本次调用的传输统计
+    """
+    # 伴奏提取微服务端点
+    url = "http://localhost:9093/remove"
 
-        # 文本响应
-        result = response.json()
-        logger.info(f"返回文本内容: {len(result['content'])} 字符")
-        logger.debug(f"前100个字符: {result['content'][:100]}")
+    logger.info(f"去除人声处理中...")
+    os.makedirs(os.path.dirname(os.path.abspath(output_audio_path)), exist_ok=True)
+    response, stats = call_service(url, audio_path, content_type=_content_type(audio_path),
+                                   params={'output_format': output_format}, output_path=output_audio_path)
+    if transfer is not None:
+        transfer.update(stats.as_dict())
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(result["content"])
-        logger.info(f"字幕保存到: {output_path}")
+    if response.status_code != 200:
+        error_msg = response.text[:500] + "..." if len(response.text) > 500 else response.text
+        logger.error(f"伴奏提取失败: HTTP {response.status_code} - {error_msg}")
+        return False
 
-        return True
+    logger.info(f"伴奏提取成功! {stats}")
 
-    except Exception as e:
-        logger.error(f"测试失败: {str(e)}")
+    # 验证输出文件
+    if not os.path.exists(output_audio_path) or os.path.getsize(output_audio_path) < 1024:
+        logger.error(f"伴奏音频保存失败或文件过小: {output_audio_path}")
         return False
-    finally:
-        # 确保文件被关闭
-        if 'files' in locals():
-            files['audio_file'][1].close()
 
+    logger.info(f"伴奏音频保存成功! 大小: {os.path.getsize(output_audio_path) / 1024:.2f} KB")
+    return True
 
 
 def vocal_remove(video_path, output_audio_path, output_format="wav"):
@@ -252,78 +413,107 @@ def vocal_remove(video_path, output_audio_path, output_format="wav"):
     返回:
         bool: 处理是否成功
     """
-    # 伴奏提取微服务端点
-    url = "http://localhost:9093/remove"
-
     # 确保伴奏提取服务正在运行
-    try:
-        # 验证服务是否可用
-        health_check = requests.get("http://localhost:9093", timeout=5)
-        if health_check.status_code != 200:
-            logger.warning(f"伴奏提取服务响应异常: HTTP {health_check.status_code}")
-    except requests.exceptions.ConnectionError:
-        logger.error("伴奏提取服务未启动！请先运行伴奏提取微服务(端口9093)")
-        return False
-    except Exception as e:
-        logger.error(f"服务检查失败: {str(e)}")
+    if not _check_vocal_remove_service():
         return False
 
-    audio_temp_dir = None
     try:
-        # 1. 从视频中提取音频
+        # 1. 按伴奏提取服务的音频规格从视频中提取音频
         logger.info(f"提取视频音频: {video_path}")
-        audio_path, audio_temp_dir = extract_audio_from_video(
-            video_path,
-            output_audio_format="wav"  # 提取时固定使用wav格式
-        )
+        audio_path = extract_audio_for(video_path, service_profile('vocal_remove'))
         if not audio_path or not os.path.exists(audio_path):
             logger.error("音频提取失败或提取的文件不存在")
             return False
         logger.info(f"成功提取音频: {audio_path}")
 
-        # 2. 发送音频到伴奏提取服务
-        logger.info(f"去除人声处理中...")
-        with open(audio_path, "rb") as f:
-            filename = os.path.basename(audio_path)
-            files = {'audio_file': (filename, f, "audio/wav")}
-            params = {'output_format': output_format}
+        # 2. 发送音频到伴奏提取服务并保存
+        return _vocal_remove_step(audio_path, output_audio_path, output_format)
 
-            start_time = time.time()
-            response = requests.post(url, files=files, params=params)
-            elapsed = time.time() - start_time
+    except Exception as e:
+        logger.error(f"人声去除失败: {str(e)}", exc_info=True)
+        return False
 
-            if response.status_code != 200:
-                error_msg = response.text[:500] + "..." if len(response.text) > 500 else response.text
-                logger.error(f"伴奏提取失败: HTTP {response.status_code} - {error_msg}")
-                return False
 
-            logger.info(f"伴奏提取成功! 处理时间: {elapsed:.2f}秒")
+def _run_action(action, video_path, audio_path, output_path, transfer):
+    """在流水线中执行一个操作，audio_path 为按该服务规格提取的音频"""
+    if action == 'vocal_remove':
+        return _check_vocal_remove_service() and _vocal_remove_step(audio_path, output_path, transfer=transfer)
+    if action == 'extract_subtitle':
+        return _check_subtitle_service() and _subtitle_step(audio_path, output_path, transfer)
+    if action == 'enhance_audio':
+        return _check_enhance_service() and _enhance_step(audio_path, video_path, output_path, transfer=transfer)
+    raise ValueError(f"未知操作类型: {action}")
 
-        # 3. 保存提取的伴奏音频
-        logger.info(f"保存伴奏音频: {output_audio_path}")
-        os.makedirs(os.path.dirname(os.path.abspath(output_audio_path)), exist_ok=True)
-        with open(output_audio_path, "wb") as f:
-            f.write(response.content)
 
-        # 验证输出文件
-        if not os.path.exists(output_audio_path) or os.path.getsize(output_audio_path) < 1024:
-            logger.error(f"伴奏音频保存失败或文件过小: {output_audio_path}")
-            return False
+def process_video(video_path, outputs, progress=None):
+    """
+    对同一视频执行多个处理操作：按各服务的音频规格提取音频，相同规格只提取一次，
+    各服务的请求并发发送，全部完成后一起返回
 
-        logger.info(f"伴奏音频保存成功! 大小: {os.path.getsize(output_audio_path) / 1024:.2f} KB")
-        return True
+    参数:
+        video_path (str): 输入视频文件路径
+        outputs (dict): 操作 -> 输出文件路径，操作取值见 ACTIONS
+        progress (callable): 进度回调 progress(阶段, 百分比, 说明)，阶段为 extract/service
 
-    except Exception as e:
-        logger.error(f"人声去除失败: {str(e)}", exc_info=True)
-        return False
-    finally:
-        # 清理临时目录
-        if audio_temp_dir and os.path.exists(audio_temp_dir):
+    返回:
+        tuple: ({操作: 是否成功}, {阶段: 耗时秒数}, {操作: 传输统计})，耗时包含 extract、各操作和 total，
+               传输统计中的 profile 为发送给该服务的音频规格
+    """
+    unknown = [action for action in outputs if action not in ACTIONS]
+    if unknown:
+        raise ValueError(f"未知操作类型: {', '.join(unknown)}")
+
+    started = time.time()
+    timings = {}
+    results = {}
+    transfers = {action: {} for action in outputs}
+    try:
+        profiles = {action: service_profile(action) for action in outputs}
+        # 接受任意音频的服务复用其他服务规格的音频，不多解码一次
+        required = [profile for profile in profiles.values() if profile]
+        fallback = required[0] if required else DEFAULT_AUDIO_PROFILE
+        profiles = {action: profile or fallback for action, profile in profiles.items()}
+        # 音频规格 -> 提取的音频路径
+        specs = {action: (profile['format'], profile['sample_rate'], profile['channels'])
+                 for action, profile in profiles.items()}
+        audio_paths = {}
+        pending = list(dict.fromkeys(specs.values()))
+        if pending:
+            if progress:
+                progress('extract', None)
+            # 不同规格各解码一次，并发进行
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                extracted = executor.map(lambda spec: extract_audio_from_video(video_path, *spec), pending)
+                audio_paths.update(zip(pending, extracted))
+            timings['extract'] = round(time.time() - started, 3)
+            if not all(audio_paths.values()):
+                return {action: False for action in outputs}, timings, transfers
+            if progress:
+                progress('extract', 100)
+
+        def run(action):
+            action_started = time.time()
+            transfers[action]['profile'] = profiles[action]
             try:
-                shutil.rmtree(audio_temp_dir)
-                logger.debug(f"清理音频临时目录: {audio_temp_dir}")
+                return _run_action(action, video_path, audio_paths[specs[action]], outputs[action],
+                                   transfers[action])
             except Exception as e:
-                logger.warning(f"临时目录清理失败: {str(e)}")
+                logger.error(f"{action} 处理失败: {str(e)}", exc_info=True)
+                return False
+            finally:
+                timings[action] = round(time.time() - action_started, 3)
+
+        if progress:
+            progress('service', 0)
+        with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+            futures = {executor.submit(run, action): action for action in outputs}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress:
+                    progress('service', len(results) * 100 // len(outputs), futures[future])
+        return results, timings, transfers
+    finally:
+        timings['total'] = round(time.time() - started, 3)
 
 if __name__ == "__main__":
 
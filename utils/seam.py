@@ -2,6 +2,7 @@ import os
 import shutil
 import tempfile
 import subprocess
+import time
 
 
 def enhance_video_audio(video_path, output_video_path, output_format="wav"):
@@ -159,6 +160,35 @@ def vocal_remove(video_path: str, output_audio_path: str, output_format: str = "
             return False
 
 
+def process_video(video_path, outputs, progress=None):
+    """
+    对同一视频执行多个处理操作（接缝版）
+    期望功能：音频只提取一次，各服务请求并发发送
+    接缝功能：依次调用上面的接缝函数
+
+    参数:
+    video_path (str): 输入视频文件路径
+    outputs (dict): 操作 -> 输出文件路径，操作为 vocal_remove / extract_subtitle / enhance_audio
+    progress (callable): 进度回调 progress(阶段, 百分比, 说明) - 此版本未使用
+
+    返回:
+    tuple: ({操作: 是否成功}, {阶段: 耗时秒数}, {操作: 传输统计})，接缝版不经网络传输，传输统计为空
+    """
+    functions = {
+        'vocal_remove': vocal_remove,
+        'extract_subtitle': extract_subtitle,
+        'enhance_audio': enhance_video_audio,
+    }
+    started = time.time()
+    results, timings = {}, {}
+    for action, output_path in outputs.items():
+        action_started = time.time()
+        results[action] = functions[action](video_path, output_path)
+        timings[action] = round(time.time() - action_started, 3)
+    timings['total'] = round(time.time() - started, 3)
+    return results, timings, {action: {} for action in outputs}
+
+
 if __name__ == '__main__':
     # 输入输出配置
     input_video = "subtitle_extract/test_video.mp4"
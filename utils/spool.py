@@ -0,0 +1,49 @@
+# 客户端（transfer.py）与三个处理服务之间的文件交接约定。
+# 处理服务运行在各自的 python 环境中，本模块只使用标准库，服务把 utils 目录加入 sys.path 后导入
+import os
+import re
+import uuid
+
+# 与处理服务共享的暂存目录，客户端和服务须配置相同的 SERVICE_SPOOL_DIR
+SERVICE_SPOOL_DIR = os.environ.get('SERVICE_SPOOL_DIR')
+
+# 上传时每次读取、保存上传文件时每次写入的字节数
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 暂存令牌：每次交接在暂存目录下新建的目录名
+TOKEN_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+class SpoolError(Exception):
+    """暂存文件无法使用，status_code 为服务应返回的 HTTP 状态码"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+def new_token():
+    """生成新的暂存令牌"""
+    return uuid.uuid4().hex
+
+
+def spool_path(token, filename, spool_dir=SERVICE_SPOOL_DIR):
+    """
+    解析暂存目录中的文件，只接受 暂存目录/令牌/文件名 形式的路径
+
+    参数:
+        token (str): 暂存令牌
+        filename (str): 令牌目录中的文件名，不能含路径
+        spool_dir (str): 暂存目录
+
+    返回:
+        str: 文件路径；未配置暂存目录、令牌或文件名无效、文件不存在时抛出 SpoolError
+    """
+    if not spool_dir:
+        raise SpoolError(404, "未配置暂存目录")
+    if not TOKEN_PATTERN.fullmatch(token or "") or not filename or os.path.basename(filename) != filename:
+        raise SpoolError(400, "暂存令牌或文件名无效")
+    path = os.path.join(spool_dir, token, filename)
+    if not os.path.isfile(path):
+        raise SpoolError(404, "暂存文件不存在")
+    return path
@@ -2,6 +2,7 @@ from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import FileResponse, Response
 import uvicorn
 import os
+import sys
 import tempfile
 from typing import Optional
 import uuid
@@ -10,6 +11,10 @@ import logging
 
 from whisperx_api import WhisperXAPI
 
+# 与客户端共享的暂存交接约定（utils/spool.py），调用方在同一台机器上时只传递暂存目录中的文件名，不上传文件内容
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spool import spool_path, SpoolError, UPLOAD_CHUNK_SIZE
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("subtitles-api")
@@ -24,6 +29,15 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 客户端提取音频时使用的规格：WhisperX 在 16kHz 单声道上识别，FLAC 无损压缩进一步减小上传体积
+AUDIO_PROFILE = {"format": "flac", "sample_rate": 16000, "channels": 1}
+
+
+@app.get("/profile")
+def audio_profile():
+    """公布本服务需要的音频格式、采样率和声道数，客户端按此提取音频"""
+    return AUDIO_PROFILE
+
 
 @app.get("/health")
 def health_check():
@@ -33,9 +47,11 @@ def health_check():
 
 @app.post("/extract")
 async def extract_subtitles(
-        audio_file: UploadFile = File(..., description="上传的音频文件（支持wav/mp3等格式）"),
+        audio_file: Optional[UploadFile] = File(None, description="上传的音频文件（支持wav/mp3等格式）"),
         return_type: str = "file",  # 支持file或text
-        output_filename: Optional[str] = None
+        output_filename: Optional[str] = None,
+        spool_token: Optional[str] = None,
+        filename: Optional[str] = None
 ):
     """
     接收音频文件并返回SRT字幕文件或文本内容
@@ -43,7 +59,33 @@ async def extract_subtitles(
     选项:
     - return_type: 返回类型 (file | text)
     - output_filename: 指定输出文件名（仅当返回文件时有效）
+    - spool_token/filename: 代替上传，处理暂存目录中的文件；返回文件时字幕写在同一目录并返回 {"output": 文件名}
     """
+    if spool_token:
+        try:
+            audio_path = spool_path(spool_token, filename)
+        except SpoolError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        try:
+            logger.info(f"处理暂存文件: {audio_path}")
+            srt_content = asr_model.transcribe(audio_path)
+            logger.info(f"成功提取字幕 ({len(srt_content)} 字符)")
+            if return_type == "text":
+                return {"filename": filename, "content": srt_content}
+            output_filename = os.path.basename(output_filename or f"{os.path.splitext(filename)[0]}.srt")
+            with open(os.path.join(os.path.dirname(audio_path), output_filename), "w", encoding="utf-8") as f:
+                f.write(srt_content)
+            return {"output": output_filename}
+        except Exception as e:
+            logger.error(f"处理失败: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"字幕提取失败: {str(e)}"
+            )
+
+    if audio_file is None:
+        raise HTTPException(status_code=400, detail="缺少 audio_file 或 spool_token")
+
     # 创建临时目录
     temp_dir = tempfile.mkdtemp()
     logger.info(f"创建临时目录: {temp_dir}")
@@ -52,9 +94,12 @@ async def extract_subtitles(
         # 保存上传的音频文件
         audio_path = os.path.join(temp_dir, audio_file.filename)
         with open(audio_path, "wb") as f:
-            content = await audio_file.read()
-            f.write(content)
-            logger.info(f"保存上传文件 ({len(content)} 字节): {audio_file.filename}")
+            size = 0
+            # 逐块写入，大文件不会整个读入内存
+            while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+            logger.info(f"保存上传文件 ({size} 字节): {audio_file.filename}")
 
         # 调用字幕提取方法
         logger.info("开始字幕提取...")
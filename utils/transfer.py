@@ -0,0 +1,223 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+try:
+    from utils.spool import SERVICE_SPOOL_DIR, UPLOAD_CHUNK_SIZE, new_token
+except ImportError:
+    # 在 utils 目录下直接运行时
+    from spool import SERVICE_SPOOL_DIR, UPLOAD_CHUNK_SIZE, new_token
+
+logger = logging.getLogger(__name__)
+
+# 上传时每次读取、下载时每次写入的字节数
+CHUNK_SIZE = UPLOAD_CHUNK_SIZE
+# 交接方式：auto 服务地址为本机时经暂存目录交接，否则上传；spool 总是先尝试交接；upload 总是上传
+SERVICE_HANDOFF = os.environ.get('SERVICE_HANDOFF', 'auto')
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+# 服务不支持或看不到暂存文件时的响应状态码，此时改为上传
+HANDOFF_REJECTED = (400, 404, 422)
+
+
+class TransferStats:
+    """一次服务调用的传输统计：上传/下载字节数，以及上传、等待处理、下载各阶段的耗时"""
+
+    def __init__(self, mode='upload'):
+        # upload 上传文件内容；spool 经暂存目录交接，不传输文件内容
+        self.mode = mode
+        self.sent = 0
+        self.received = 0
+        self.started = time.time()
+        self.uploaded = None
+        self.responded = None
+        self.finished = None
+
+    def as_dict(self):
+        upload = (self.uploaded or self.started) - self.started
+        wait = (self.responded or self.uploaded or self.started) - (self.uploaded or self.started)
+        download = (self.finished or self.responded or self.started) - (self.responded or self.started)
+        return {
+            'mode': self.mode,
+            'sent': self.sent,
+            'received': self.received,
+            'upload_seconds': round(upload, 3),
+            'wait_seconds': round(wait, 3),
+            'download_seconds': round(download, 3),
+            'total_seconds': round((self.finished or time.time()) - self.started, 3),
+        }
+
+    def __str__(self):
+        d = self.as_dict()
+        if self.mode == 'spool':
+            return f"经暂存目录交接, 处理 {d['wait_seconds']}秒"
+        return (f"上传 {d['sent']} 字节 {d['upload_seconds']}秒, 等待处理 {d['wait_seconds']}秒, "
+                f"下载 {d['received']} 字节 {d['download_seconds']}秒")
+
+
+class MultipartUpload:
+    """
+    以 multipart/form-data 逐块发送单个文件的请求体。
+    提供 read() 和 __len__，requests 据此设置 Content-Length 并分块读取，不会把整个文件读入内存。
+    """
+
+    def __init__(self, field, path, filename=None, content_type='application/octet-stream', stats=None):
+        self.boundary = uuid.uuid4().hex
+        self.path = path
+        self.stats = stats
+        filename = filename or os.path.basename(path)
+        self.head = (f'--{self.boundary}\r\n'
+                     f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.size = len(self.head) + os.path.getsize(path) + len(self.tail)
+        self.parts = self._parts()
+        # 当前块及其中已读到的位置，只切出需要的部分，不复制整块
+        self.current = b''
+        self.position = 0
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.size
+
+    def _parts(self):
+        yield self.head
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        yield self.tail
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self.position >= len(self.current):
+                self.current = next(self.parts, b'')
+                self.position = 0
+                if not self.current:
+                    break
+            end = len(self.current) if size < 0 else min(len(self.current), self.position + size)
+            pieces.append(self.current[self.position:end])
+            if size > 0:
+                size -= end - self.position
+            self.position = end
+        data = b''.join(pieces)
+        if self.stats:
+            self.stats.sent += len(data)
+            if not data or self.stats.sent >= self.size:
+                self.stats.uploaded = self.stats.uploaded or time.time()
+        return data
+
+
+def post_file(url, path, field='audio_file', content_type='application/octet-stream', params=None,
+              output_path=None, timeout=None):
+    """
+    流式上传文件到服务；给出 output_path 时把成功的响应体逐块写入该文件
+
+    参数:
+        url (str): 服务端点
+        path (str): 上传的文件路径
+        output_path (str): 响应体的保存路径，先写入临时文件，完整接收后再改名
+        timeout: 连接/读取超时，传给 requests
+
+    返回:
+        tuple: (响应, TransferStats)。写入文件时响应体已被读取，不能再访问 response.content；
+               失败的响应不写文件，可读取 response.text 查看错误
+    """
+    stats = TransferStats()
+    body = MultipartUpload(field, path, content_type=content_type, stats=stats)
+    response = requests.post(url, data=body, params=params, headers={'Content-Type': body.content_type},
+                             stream=True, timeout=timeout)
+    stats.uploaded = stats.uploaded or time.time()
+    stats.responded = time.time()
+    try:
+        if output_path and response.status_code == 200:
+            tmp_path = f"{output_path}.{uuid.uuid4().hex}.part"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        stats.received += len(chunk)
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        else:
+            # 错误信息或 JSON 结果，体积很小
+            stats.received = len(response.content)
+    finally:
+        stats.finished = time.time()
+        response.close()
+    return response, stats
+
+
+def _can_handoff(url):
+    if not SERVICE_SPOOL_DIR or SERVICE_HANDOFF == 'upload':
+        return False
+    return SERVICE_HANDOFF == 'spool' or urlparse(url).hostname in LOCAL_HOSTS
+
+
+def _spool(path):
+    """
+    把文件放入暂存目录下新建的令牌目录，同一文件系统上用硬链接，不复制内容
+    返回: (令牌, 令牌目录, 暂存文件名)
+    """
+    token = new_token()
+    directory = os.path.join(SERVICE_SPOOL_DIR, token)
+    os.makedirs(directory)
+    filename = os.path.basename(path)
+    try:
+        os.link(path, os.path.join(directory, filename))
+    except OSError:
+        shutil.copyfile(path, os.path.join(directory, filename))
+    return token, directory, filename
+
+
+def _handoff(url, path, params, output_path, timeout):
+    """经暂存目录调用服务：服务原地读取文件，把输出写在同一令牌目录中，响应中给出输出文件名"""
+    stats = TransferStats('spool')
+    token, directory, filename = _spool(path)
+    try:
+        stats.uploaded = time.time()
+        response = requests.post(url, params={**(params or {}), 'spool_token': token, 'filename': filename},
+                                 timeout=timeout)
+        stats.responded = time.time()
+        if response.status_code == 200 and output_path:
+            output = os.path.join(directory, os.path.basename(response.json()['output']))
+            # 暂存目录可能与输出目录不在同一文件系统，先移到输出目录再原子改名
+            tmp_path = f"{output_path}.{uuid.uuid4().hex}.part"
+            try:
+                shutil.move(output, tmp_path)
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        stats.finished = time.time()
+        return response, stats
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def call_service(url, path, field='audio_file', content_type='application/octet-stream', params=None,
+                 output_path=None, timeout=None):
+    """
+    调用处理服务。服务在本机且配置了共享暂存目录时只传递文件名，服务原地读取、在旁边写出结果，
+    省去上传和服务端写临时文件两次复制；服务在远端或拒绝交接时改为流式上传，见 post_file。
+
+    参数和返回值同 post_file；经暂存目录交接成功时响应为服务返回的 JSON
+    """
+    if _can_handoff(url):
+        response, stats = _handoff(url, path, params, output_path, timeout)
+        if response.status_code not in HANDOFF_REJECTED:
+            return response, stats
+        logger.info(f"服务未接受暂存目录交接 (HTTP {response.status_code})，改为上传: {url}")
+    return post_file(url, path, field, content_type, params, output_path, timeout)
@@ -6,10 +6,15 @@ import soundfile as sf  # 用于音频文件读写
 import io
 import tempfile
 import os
+import sys
 from typing import Optional, Tuple
 
 from spleeter_api import SpleeterAPI
 
+# 与客户端共享的暂存交接约定（utils/spool.py），调用方在同一台机器上时只传递暂存目录中的文件名，不上传文件内容
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spool import spool_path, SpoolError, UPLOAD_CHUNK_SIZE
+
 vr_model = SpleeterAPI()
 
 def remove(input_wav_path: str) -> Tuple[np.ndarray, int]:
@@ -33,14 +38,28 @@ def remove(input_wav_path: str) -> Tuple[np.ndarray, int]:
 
 app = FastAPI(title="伴奏提取微服务")
 
+# 客户端提取音频时使用的规格：Spleeter 在 44.1kHz 立体声上分离，FLAC 无损压缩减小上传体积
+AUDIO_PROFILE = {"format": "flac", "sample_rate": 44100, "channels": 2}
+
+
+@app.get("/profile")
+def audio_profile():
+    """公布本服务需要的音频格式、采样率和声道数，客户端按此提取音频"""
+    return AUDIO_PROFILE
+
 
 @app.post("/remove")
 async def remove_vocal(
-        audio_file: UploadFile = File(..., description="上传的音频文件（支持wav/mp3等格式）"),
-        output_format: Optional[str] = "wav"
+        audio_file: Optional[UploadFile] = File(None, description="上传的音频文件（支持wav/mp3等格式）"),
+        output_format: Optional[str] = "wav",
+        spool_token: Optional[str] = None,
+        filename: Optional[str] = None
 ):
     """
     接收音频文件并返回增强后的音频文件
+
+    选项:
+    - spool_token/filename: 代替上传，处理暂存目录中的文件，结果写在同一目录并返回 {"output": 文件名}
     """
     # 支持的输出格式
     SUPPORTED_FORMATS = ["wav", "flac", "ogg"]
@@ -50,13 +69,35 @@ async def remove_vocal(
             detail=f"不支持的输出格式，请选择: {', '.join(SUPPORTED_FORMATS)}"
         )
 
+    if spool_token:
+        try:
+            input_path = spool_path(spool_token, filename)
+        except SpoolError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        try:
+            enhanced_audio, sample_rate = remove(input_path)
+            output_filename = f"{os.path.splitext(filename)[0]}_enhanced.{output_format.lower()}"
+            sf.write(os.path.join(os.path.dirname(input_path), output_filename), enhanced_audio, sample_rate,
+                     format=output_format.lower())
+            return {"output": output_filename}
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"音频增强失败: {str(e)}"
+            )
+
+    if audio_file is None:
+        raise HTTPException(status_code=400, detail="缺少 audio_file 或 spool_token")
+
     # 创建临时目录
     with tempfile.TemporaryDirectory() as temp_dir:
         try:
             # 保存上传的音频文件
             input_path = os.path.join(temp_dir, audio_file.filename)
             with open(input_path, "wb") as f:
-                f.write(await audio_file.read())
+                # 逐块写入，大文件不会整个读入内存
+                while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+                    f.write(chunk)
 
             # 调用音频增强方法
             enhanced_audio, sample_rate = remove(input_path)
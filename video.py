@@ -3,113 +3,629 @@ import sys
 
 import requests
 import re
-import json
 import subprocess
 import os
-import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, parse_qs
 
+from downloader import download_streams, discard_partial, cleanup_partials, pipe_stream, StreamStats, \
+    PARTIAL_SUFFIX
+from catalog import Catalog
+from clip import CLIP_MODE, CLIP_PRESET, CLIP_CRF
+from clip_cache import ClipCache
+from dash import fetch_window
+from locks import KeyLock
+from meta_cache import MetaCache
+from mirrors import selector
+from page_info import extract_page_info
+from store import DownloadStore
 
-def merge_av(audio_file, video_file, output_file):
+
+DOWNLOAD_DIR = os.path.join(os.getcwd(), 'downloads')
+
+# 索引数据库、下载锁和元数据缓存所在目录，不能放在经 /downloads 对外提供的下载目录下
+STATE_DIR = os.environ.get('STATE_DIR', os.path.join(os.getcwd(), 'state'))
+
+
+def _migrate_state():
+    """把旧版本放在下载目录里的索引数据库和元数据缓存移到状态目录（状态目录中已有的不覆盖）"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    for name in ('catalog.db', 'catalog.db-wal', 'catalog.db-shm', '.meta'):
+        old = os.path.join(DOWNLOAD_DIR, name)
+        new = os.path.join(STATE_DIR, name.lstrip('.'))
+        if os.path.exists(old) and not os.path.exists(new):
+            try:
+                shutil.move(old, new)
+            except FileNotFoundError:
+                # 其他工作进程同时启动，已经移走
+                pass
+
+
+_migrate_state()
+
+# 下载目录的 SQLite 索引，多个工作进程共享
+catalog = Catalog(os.path.join(STATE_DIR, 'catalog.db'))
+
+# 下载存储，按视频ID、分P和清晰度定位文件
+store = DownloadStore(DOWNLOAD_DIR, catalog)
+
+# 剪辑结果缓存，相同源文件、起止时间和剪辑参数的请求直接返回已有片段
+clip_cache = ClipCache(catalog)
+
+# 按存储键加的下载锁，同一视频同一时间只有一个请求（线程或工作进程）在下载
+download_locks = KeyLock(os.path.join(STATE_DIR, 'locks'))
+
+# 页面元数据缓存，保存在状态目录下，重启后仍然有效
+meta_cache = MetaCache(os.path.join(STATE_DIR, 'meta'))
+
+# 合并模式：file 先完整下载到部分文件再合并（支持多连接和断点续传）；
+# stream 把 HTTP 响应体经命名管道直接送入 ffmpeg，不落临时文件
+MERGE_MODE = os.environ.get('MERGE_MODE', 'file')
+
+# 编码偏好名称 -> (B站 codecid, codecs 前缀)
+CODECS = {
+    'avc': (7, ('avc1', 'avc3')),
+    'hevc': (12, ('hev1', 'hvc1')),
+    'av1': (13, ('av01',)),
+}
+
+# 读取视频页面时每块的字节数
+PAGE_READ_SIZE = 16 * 1024
+
+# 批量下载时同时下载的视频数。页面链接都在同一主机上，CDN 主机要到解析播放地址后才知道，
+# 所以只限制总数；每个视频的连接数由 DOWNLOAD_WORKERS 控制
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+
+# 片段时长超过全片的该比例时直接下载完整视频
+CLIP_FIRST_MAX_RATIO = float(os.environ.get('CLIP_FIRST_MAX_RATIO', 0.5))
+
+# 根据操作系统选择 ffmpeg 命令
+FFMPEG_CMD = 'ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg'
+
+
+def _merge_cmd(audio_input, video_input, output_file, copy_audio):
+    return [
+        FFMPEG_CMD,
+        '-y',
+        '-i', audio_input,
+        '-i', video_input,
+        '-map', '1:v:0',
+        '-map', '0:a:0',
+        '-c:v', 'copy',  # 视频流直接复制
+        '-c:a', 'copy' if copy_audio else 'aac',  # 音频已是AAC时直接复制，否则转AAC
+        '-movflags', '+faststart',  # moov 前置，浏览器可边下边播
+        '-f', 'mp4',
+        output_file
+    ]
+
+
+def merge_av(audio_file, video_file, output_file, copy_audio=False):
     """
-    合并音频和视频文件
+    合并音频和视频文件，先写入临时文件，成功后再改名为输出文件
     :param audio_file: 音频文件路径
     :param video_file: 视频文件路径
     :param output_file: 输出文件路径
+    :param copy_audio: 音频是否直接复制（音频已是AAC时）
     :return: 合并是否成功
     """
+    tmp_file = output_file + '.merging'
     try:
-        # 根据操作系统选择 ffmpeg 命令
-        ffmpeg_cmd = 'ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg'
-
-        cmd = [
-            ffmpeg_cmd,
-            '-i', audio_file,
-            '-i', video_file,
-            '-c:v', 'copy',  # 视频流直接复制
-            '-c:a', 'aac',  # 音频转AAC格式
-            output_file
-        ]
-
+        cmd = _merge_cmd(audio_file, video_file, tmp_file, copy_audio)
         subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-        if os.path.exists(output_file):
+        if os.path.exists(tmp_file):
+            os.replace(tmp_file, output_file)
             return True
         return False
     except subprocess.CalledProcessError as e:
-        print(f"合并失败: {e.stderr.decode('utf-8')}")
+        print(f"合并失败: {e.stderr.decode('utf-8', errors='replace')}")
+        return False
+    except Exception as e:
+        print(f"发生错误: {str(e)}")
+        return False
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _feed_fifo(url, headers, fifo_path, stats, errors):
+    """把一路流写入命名管道；ffmpeg 提前退出时写端会收到 BrokenPipeError"""
+    try:
+        with open(fifo_path, 'wb') as fifo:
+            pipe_stream(url, headers, fifo, stats)
+    except Exception as e:
+        errors.append(e)
+
+
+def _release_fifo(fifo_path):
+    """以非阻塞方式打开读端再关闭，使仍阻塞在 open 上的写线程返回"""
+    try:
+        os.close(os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK))
+    except OSError:
+        pass
+
+
+def merge_av_stream(audio_url, video_url, headers, output_file, copy_audio=False):
+    """
+    流式合并：音视频的 HTTP 响应体经命名管道直接送入 ffmpeg，不写临时文件
+    :param audio_url: 音频流地址
+    :param video_url: 视频流地址
+    :param headers: 请求头
+    :param output_file: 输出文件路径
+    :param copy_audio: 音频是否直接复制（音频已是AAC时）
+    :return: 合并是否成功
+    """
+    if not hasattr(os, 'mkfifo'):
         return False
+
+    tmp_file = output_file + '.merging'
+    fifo_dir = tempfile.mkdtemp()
+    audio_fifo = os.path.join(fifo_dir, 'audio')
+    video_fifo = os.path.join(fifo_dir, 'video')
+    os.mkfifo(audio_fifo)
+    os.mkfifo(video_fifo)
+
+    stats = {'音频': StreamStats('音频'), '视频': StreamStats('视频')}
+    errors = []
+    feeders = [
+        threading.Thread(target=_feed_fifo, args=(audio_url, headers, audio_fifo, stats['音频'], errors), daemon=True),
+        threading.Thread(target=_feed_fifo, args=(video_url, headers, video_fifo, stats['视频'], errors), daemon=True),
+    ]
+    try:
+        process = subprocess.Popen(_merge_cmd(audio_fifo, video_fifo, tmp_file, copy_audio),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        for feeder in feeders:
+            feeder.start()
+        _, stderr = process.communicate()
+
+        for fifo_path in (audio_fifo, video_fifo):
+            _release_fifo(fifo_path)
+        for feeder in feeders:
+            feeder.join()
+
+        if process.returncode != 0:
+            print(f"流式合并失败: {stderr.decode('utf-8', errors='replace')}")
+            return False
+        if errors:
+            print(f"流式下载失败: {errors[0]}")
+            return False
+
+        for stream_stats in stats.values():
+            print(f"下载完成 {stream_stats}")
+        os.replace(tmp_file, output_file)
+        return True
     except Exception as e:
         print(f"发生错误: {str(e)}")
         return False
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        shutil.rmtree(fifo_dir, ignore_errors=True)
+
+
+def parse_video_id(url):
+    """
+    从视频链接中解析视频ID和分P序号
+    :param url: B站视频链接
+    :return: (视频ID, 分P序号)，如 ('BV1PkTszjE11', 1)
+    """
+    parsed = urlparse(url)
+    id_match = re.search(r'/video/(BV[0-9A-Za-z]{10}|av\d+)', parsed.path, re.IGNORECASE)
+    if not id_match:
+        raise ValueError("无法从链接中解析视频ID")
+    video_id = id_match.group(1)
+    if video_id[:2].lower() == 'av':
+        video_id = video_id.lower()
+
+    page = parse_qs(parsed.query).get('p', ['1'])[0]
+    return video_id, int(page) if page.isdigit() and int(page) > 0 else 1
+
+
+def fetch_page_info(url, headers):
+    """
+    流式读取视频页面，拿到标题和播放信息后立即停止读取
+    :return: (标题, 播放信息JSON)
+    :raises PageParseError: 页面中缺少标题或播放信息
+    """
+    with requests.get(url, headers=headers, stream=True) as resp:
+        resp.raise_for_status()
+        return extract_page_info(resp.iter_content(chunk_size=PAGE_READ_SIZE))
+
+
+def codec_name(stream):
+    """根据 codecid/codecs 返回流的编码名称 avc/hevc/av1"""
+    for name, (codec_id, prefixes) in CODECS.items():
+        if stream.get('codecid') == codec_id or stream.get('codecs', '').startswith(prefixes):
+            return name
+    return stream.get('codecs', '').split('.')[0] or 'unknown'
+
+
+def stream_url(stream):
+    """流的下载地址，优先使用备用地址"""
+    return (stream.get('backupUrl') or stream.get('backup_url') or [stream.get('baseUrl') or stream.get('base_url')])[0]
+
+
+def stream_urls(stream):
+    """流的全部候选地址（主地址和备用地址），去重后保持原顺序"""
+    urls = [stream.get('baseUrl') or stream.get('base_url')]
+    urls += stream.get('backupUrl') or stream.get('backup_url') or []
+    return list(dict.fromkeys(u for u in urls if u))
+
+
+def fastest_url(stream, headers):
+    """按镜像测速排名选出最快的地址"""
+    return selector.rank(stream_urls(stream), headers)[0]
+
+
+def estimate_size(stream, duration):
+    """按码率估算流的字节数"""
+    return int(stream.get('bandwidth', 0) * duration / 8)
 
 
-def get_video(url):
-    headers = {
+def select_streams(playinfo, resolution=None, codec=None, max_bytes=None, audio_only=False):
+    """
+    从播放信息的全部 dash.video/dash.audio 中选择要下载的流
+    :param playinfo: 播放信息JSON
+    :param resolution: 目标分辨率（高度，如 720），选不超过它的最高清晰度
+    :param codec: 编码偏好 avc/hevc/av1，没有该编码时忽略
+    :param max_bytes: 音视频合计的最大字节数，按码率和时长估算
+    :param audio_only: 只选择音频
+    :return: (音频流, 视频流)，audio_only 时视频流为 None
+    """
+    dash = playinfo['data']['dash']
+    duration = dash.get('duration') or playinfo['data'].get('timelength', 0) / 1000
+    audios = sorted(dash.get('audio') or [], key=lambda a: a.get('bandwidth', 0), reverse=True)
+    if not audios:
+        raise ValueError("播放信息中没有音频流")
+
+    def best_audio(budget):
+        for audio in audios:
+            if budget is None or estimate_size(audio, duration) <= budget:
+                return audio
+        return audios[-1]
+
+    if audio_only:
+        return best_audio(max_bytes), None
+
+    videos = sorted(dash.get('video') or [], key=lambda v: v.get('bandwidth', 0), reverse=True)
+    if not videos:
+        raise ValueError("播放信息中没有视频流")
+
+    if codec:
+        if codec not in CODECS:
+            raise ValueError(f"不支持的编码偏好: {codec}，可选: {', '.join(CODECS)}")
+        videos = [v for v in videos if codec_name(v) == codec] or videos
+
+    if resolution:
+        fitting = [v for v in videos if v.get('height', 0) <= int(resolution)]
+        videos = fitting or [min(videos, key=lambda v: v.get('height', 0))]
+
+    if max_bytes is not None:
+        max_bytes = int(max_bytes)
+        for video in videos:
+            remaining = max_bytes - estimate_size(video, duration)
+            audio = best_audio(remaining)
+            if remaining >= 0 and estimate_size(audio, duration) <= remaining:
+                return audio, video
+        return audios[-1], videos[-1]
+
+    return audios[0], videos[0]
+
+
+def request_headers(url):
+    return {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.67',
         'Referer': url
     }
 
+
+def load_page_entry(url, video_id, page, headers):
+    """读取页面元数据，没有缓存或缓存的流地址已过期时重新抓取页面"""
+    entry = meta_cache.get(video_id, page)
+    if not entry or not meta_cache.urls_valid(entry):
+        title, json_data = fetch_page_info(url, headers)
+        default_audio, default_video = select_streams(json_data)
+        entry = meta_cache.put(video_id, page, title, json_data,
+                               stream_url(default_audio), stream_url(default_video))
+    return entry
+
+
+def _stage_progress(progress, stage):
+    """把 progress(阶段, 百分比) 形式的回调转成下载引擎使用的 progress(百分比)"""
+    return (lambda percent: progress(stage, percent)) if progress else None
+
+
+def get_video(url, resolution=None, codec=None, max_bytes=None, audio_only=False, progress=None):
+    """
+    下载视频（已下载时直接返回）
+    :param url: B站视频链接
+    :param resolution: 目标分辨率（高度），见 select_streams
+    :param codec: 编码偏好 avc/hevc/av1
+    :param max_bytes: 最大字节数
+    :param audio_only: 只下载音频，已有完整视频时直接使用完整视频
+    :param progress: 进度回调 progress(阶段, 百分比)，阶段为 download/merge
+    :return: 下载存储中的记录，包含 key、title、filename 等
+    """
+    headers = request_headers(url)
+
+    video_id, page = parse_video_id(url)
+    selecting = any(v is not None for v in (resolution, codec, max_bytes))
+
     # 创建下载目录
-    download_dir = os.path.join(os.getcwd(), 'downloads')
-    os.makedirs(download_dir, exist_ok=True)
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    cleanup_partials(DOWNLOAD_DIR)
 
-    # 获取页面
-    resp = requests.get(url, headers=headers)
-    resp.raise_for_status()
+    # 未指定清晰度时按视频ID查下载存储，同一视频的不同链接形式都能命中，且不发起任何网络请求
+    if not selecting:
+        record = store.find(video_id, page, ('audio', 'video') if audio_only else ('video',))
+        if record:
+            print(f"文件已存在，跳过下载：{store.file_path(record)}")
+            return record
 
-    # 提取标题
-    title_match = re.search(r'<h1[^>]*>(.*?)</h1>', resp.text, re.DOTALL)
-    if title_match:
-        title = title_match.group(1).strip()
+    entry = load_page_entry(url, video_id, page, headers)
+    title = entry['title']
+    audio_info, video_info = select_streams(entry['playinfo'], resolution, codec, max_bytes, audio_only)
+
+    if audio_only:
+        # 只下载音频流，DASH 音频本身就是可直接使用的 m4a
+        quality = f"a{audio_info['id']}"
     else:
-        raise ValueError("无法提取标题")
+        quality = f"{video_info['id']}{codec_name(video_info)}"
+    key = store.key(video_id, page, quality)
 
-    # 生成输出文件路径（这里不加时间戳）
-    output_path = os.path.join(download_dir, f"{title}.mp4")
+    # 同一视频的并发请求在这里排队：先到的下载，其余等它完成后直接命中下载存储，
+    # 不会同时写同一组部分文件，也不会读到合并了一半的文件
+    with download_locks.hold(key):
+        record = store.get(key)
+        if record:
+            print(f"文件已存在，跳过下载：{store.file_path(record)}")
+            return record
+        if audio_only:
+            _download_audio(key, audio_info, headers, progress)
+            return store.add(video_id, page, quality, title, kind='audio')
+        _download_video(key, audio_info, video_info, headers, progress)
+        return store.add(video_id, page, quality, title)
 
-    # 如果目标文件已存在，直接返回标题，跳过下载
-    if os.path.exists(output_path):
-        print(f"文件已存在，跳过下载：{output_path}")
-        return title
 
-    # 提取播放信息 JSON
-    json_data_match = re.search(r'<script>window.__playinfo__=(.*?)</script>', resp.text, re.DOTALL)
-    if json_data_match:
-        json_data = json.loads(json_data_match.group(1))
-    else:
-        raise ValueError("无法提取播放信息")
+def _download_audio(key, audio_info, headers, progress=None):
+    """下载音频流到 store.path(key, 'm4a')，须持有该键的下载锁"""
+    audio_path = os.path.join(DOWNLOAD_DIR, f"{key}.audio{PARTIAL_SUFFIX}")
+    stats = download_streams({'音频': (stream_urls(audio_info), audio_path)}, headers,
+                             progress=_stage_progress(progress, 'download'))
+    print(f"下载完成 {stats['音频']}")
+    os.replace(audio_path, store.path(key, 'm4a'))
+    discard_partial(audio_path)
+
+
+def _download_video(key, audio_info, video_info, headers, progress=None):
+    """下载音视频流并合并到 store.path(key)，须持有该键的下载锁"""
+    output_path = store.path(key)
+    print(f"选择视频流: {video_info.get('height')}p {codec_name(video_info)}, 音频流: {audio_info['id']}")
 
-    # 提取音视频 URL
-    audio_url = json_data['data']['dash']['audio'][0]['backupUrl'][0]
-    video_url = json_data['data']['dash']['video'][0]['backupUrl'][0]
+    # DASH 音频通常已是 AAC（mp4a），此时合并时直接复制，无需转码
+    copy_audio = audio_info.get('codecs', '').startswith('mp4a')
 
-    # 生成带时间戳的临时保存路径，防止文件覆盖
-    timestamp = int(time.time())
-    audio_path = os.path.join(download_dir, f"{title}_{timestamp}.mp3")
-    video_path = os.path.join(download_dir, f"{title}_{timestamp}.mp4")
+    if MERGE_MODE == 'stream':
+        if progress:
+            progress('download', None)
+        if merge_av_stream(fastest_url(audio_info, headers), fastest_url(video_info, headers),
+                           headers, output_path, copy_audio):
+            print(f"流式合并成功，输出文件: {output_path}")
+            return
+        print("流式合并失败，改为下载后合并")
 
-    # 下载音频和视频
-    with requests.get(audio_url, headers=headers, stream=True) as audio_resp, \
-            requests.get(video_url, headers=headers, stream=True) as video_resp:
-        audio_resp.raise_for_status()
-        video_resp.raise_for_status()
+    # 临时保存路径按视频ID固定，中断后再次调用可以续传
+    audio_path = os.path.join(DOWNLOAD_DIR, f"{key}.audio{PARTIAL_SUFFIX}")
+    video_path = os.path.join(DOWNLOAD_DIR, f"{key}.video{PARTIAL_SUFFIX}")
 
-        with open(audio_path, 'wb') as audio_file, open(video_path, 'wb') as video_file:
-            for chunk in audio_resp.iter_content(chunk_size=8192):
-                audio_file.write(chunk)
-            for chunk in video_resp.iter_content(chunk_size=8192):
-                video_file.write(chunk)
+    # 并发下载音频和视频，每路流按字节范围分段多连接获取
+    stats = download_streams({
+        '音频': (stream_urls(audio_info), audio_path),
+        '视频': (stream_urls(video_info), video_path),
+    }, headers, progress=_stage_progress(progress, 'download'))
+    for stream_stats in stats.values():
+        print(f"下载完成 {stream_stats}")
 
     # 合并音视频
-    if merge_av(audio_path, video_path, output_path):
-        print(f"合并成功，输出文件: {output_path}")
-        # 下载完成后删除临时文件
-        os.remove(audio_path)
-        os.remove(video_path)
-    else:
-        print("合并失败")
+    if progress:
+        progress('merge', None)
+    if not merge_av(audio_path, video_path, output_path, copy_audio):
+        raise RuntimeError("音视频合并失败")
+    if progress:
+        progress('merge', 100)
+
+    print(f"合并成功，输出文件: {output_path}")
+    # 合并成功后删除临时文件及续传日志
+    discard_partial(audio_path)
+    discard_partial(video_path)
+
+
+def part_urls(video_id, parts):
+    """
+    由视频ID和分P范围生成各分P的页面链接
+    :param parts: '1-40'、'1,3,5-7' 形式的字符串，或分P序号列表
+    """
+    if isinstance(parts, str):
+        numbers = []
+        for item in parts.split(','):
+            first, _, last = item.strip().partition('-')
+            numbers += range(int(first), int(last or first) + 1)
+        parts = numbers
+    return [f"https://www.bilibili.com/video/{video_id}?p={int(p)}" for p in dict.fromkeys(parts)]
+
+
+def get_videos(urls, workers=None, progress=None, **options):
+    """
+    批量下载多个视频（多P视频、合集），已下载的条目直接跳过
+    :param urls: 视频链接列表
+    :param workers: 同时下载的视频数，默认 BATCH_WORKERS
+    :param progress: 进度回调 progress(阶段, 百分比, 说明)，按已完成的条目数报告
+    :param options: 传给 get_video 的清晰度选择参数
+    :return: 与 urls 一一对应的结果列表，status 为 cached/downloaded/failed
+    """
+    workers = workers or BATCH_WORKERS
+    results = [None] * len(urls)
+    pending = []
+
+    for i, url in enumerate(urls):
+        try:
+            video_id, page = parse_video_id(url)
+        except ValueError as e:
+            results[i] = {'url': url, 'status': 'failed', 'error': str(e)}
+            continue
+        record = None if options else store.find(video_id, page)
+        if record:
+            results[i] = {'url': url, 'status': 'cached', 'video_id': record['key'], 'title': record['title']}
+            continue
+        pending.append((i, url))
+
+    def report():
+        if progress and urls:
+            done = sum(1 for result in results if result)
+            progress('download', done / len(urls) * 100, f"{done}/{len(urls)}")
+
+    report()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as pool:
+        futures = {pool.submit(get_video, url, **options): (i, url) for i, url in pending}
+        for future in as_completed(futures):
+            i, url = futures[future]
+            try:
+                record = future.result()
+                results[i] = {'url': url, 'status': 'downloaded', 'video_id': record['key'], 'title': record['title']}
+            except Exception as e:
+                results[i] = {'url': url, 'status': 'failed', 'error': str(e)}
+            print(f"批量下载 [{results[i]['status']}] {url}")
+            report()
+
+    return results
+
+
+def _time_label(seconds):
+    """精确到毫秒的时间文本，去掉多余的 0，如 7.3、1234.567"""
+    return f"{float(seconds):.3f}".rstrip('0').rstrip('.')
+
+
+def clip_filename(key, start, end, tag=None):
+    """片段文件名，由视频存储键、起止时间和可选的标记（如剪辑模式）组成"""
+    suffix = f"_{tag}" if tag else ''
+    return f"{key}_{_time_label(start)}-{_time_label(end)}{suffix}.mp4"
+
+
+def window_tag(mode):
+    """片段优先下载的文件名标记，与完整视频剪辑出的同一范围的片段区分开"""
+    return 'window' if mode == 'smart' else f'{mode}_window'
+
+
+def cut_window(audio_file, video_file, start, end, output_file):
+    """
+    从只含部分子分段的音视频文件中剪出 [start, end)，编码参数和选帧规则与 clip.cut_exact 相同。
+    分片文件保留原始时间戳，两个输入都按绝对时间定位，保证音画对齐。
+    """
+    duration = end - start
+    cmd = [FFMPEG_CMD, '-y']
+    for input_file in (audio_file, video_file):
+        cmd += ['-seek_timestamp', '1', '-ss', f"{start:.3f}", '-i', input_file]
+    cmd += [
+        '-map', '1:v:0',
+        '-map', '0:a:0',
+        '-vf', f"trim=end={duration:.3f}",
+        '-af', f"atrim=end={duration:.3f}",
+        '-fps_mode', 'passthrough',
+        '-c:v', 'libx264',
+        '-preset', CLIP_PRESET,
+        '-crf', str(CLIP_CRF),
+        '-c:a', 'aac',
+        '-movflags', '+faststart',
+        '-f', 'mp4',
+        output_file
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def download_clip(url, start, end, resolution=None, codec=None, max_bytes=None, mode=None, progress=None):
+    """
+    片段优先下载：按 sidx 索引只获取覆盖 [start, end] 的子分段并剪辑成片段。
+    完整视频已下载、片段接近全片或流不带 SegmentBase 时不适用，返回 None，
+    由调用方下载完整视频后再剪辑。
+    :param mode: 请求的剪辑模式。子分段总是整段重编码，模式只标记在文件名和缓存键中，
+                 不会覆盖之后从完整视频剪出的同一范围的片段
+    :param progress: 进度回调 progress(阶段, 百分比)，阶段为 download/encode
+    :return: {'key', 'title', 'filename', 'cached'}，不适用时为 None
+    """
+    start, end = float(start), float(end)
+    if end <= start:
+        raise ValueError("结束时间必须大于开始时间")
+
+    headers = request_headers(url)
+    video_id, page = parse_video_id(url)
+    selecting = any(v is not None for v in (resolution, codec, max_bytes))
+    if not selecting and store.find(video_id, page):
+        return None
+
+    entry = load_page_entry(url, video_id, page, headers)
+    audio_info, video_info = select_streams(entry['playinfo'], resolution, codec, max_bytes)
+    key = store.key(video_id, page, f"{video_info['id']}{codec_name(video_info)}")
+    if store.get(key):
+        return None
+
+    duration = entry['playinfo']['data']['dash'].get('duration') or 0
+    if duration and end - start > duration * CLIP_FIRST_MAX_RATIO:
+        return None
+
+    mode = mode or CLIP_MODE
+    filename = clip_filename(key, start, end, window_tag(mode))
+    output_path = os.path.join(DOWNLOAD_DIR, filename)
+
+    def fetch_and_cut():
+        # 其他工作进程的相同请求只下载一次
+        with download_locks.hold(filename):
+            if os.path.exists(output_path):
+                return
+            _fetch_and_cut_window(audio_info, video_info, headers, start, end, output_path, progress)
+
+    try:
+        path, hit = clip_cache.cut_window(key, start, end, output_path, mode, fetch_and_cut)
+    except subprocess.CalledProcessError as e:
+        print(f"片段剪辑失败，改为下载完整视频: {e.stderr.decode('utf-8', errors='replace')}")
+        return None
+    except (ValueError, IOError, requests.RequestException) as e:
+        print(f"片段优先下载不可用，改为下载完整视频: {str(e)}")
+        return None
+    return {'key': key, 'title': entry['title'], 'filename': os.path.basename(path), 'cached': hit}
+
+
+def _fetch_and_cut_window(audio_info, video_info, headers, start, end, output_path, progress=None):
+    """下载覆盖 [start, end] 的音视频子分段，剪辑后原子地放到 output_path"""
+    work_dir = tempfile.mkdtemp()
+    try:
+        audio_path = os.path.join(work_dir, 'audio.mp4')
+        video_path = os.path.join(work_dir, 'video.mp4')
+        if progress:
+            progress('download', 0)
+        fetch_window(fastest_url(audio_info, headers), audio_info, headers, start, end, audio_path)
+        if progress:
+            progress('download', 20)
+        fetch_window(fastest_url(video_info, headers), video_info, headers, start, end, video_path)
+        if progress:
+            progress('download', 100)
+        print(f"片段优先下载: 音频 {os.path.getsize(audio_path)} 字节, 视频 {os.path.getsize(video_path)} 字节")
 
-    return title
+        tmp_path = os.path.join(work_dir, 'clip.mp4')
+        if progress:
+            progress('encode', None)
+        cut_window(audio_path, video_path, start, end, tmp_path)
+        if progress:
+            progress('encode', 100)
+        # 临时目录可能在另一个文件系统上，先复制到下载目录再原子改名，不会暴露复制了一半的文件
+        shutil.move(tmp_path, output_path + '.moving')
+        os.replace(output_path + '.moving', output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if os.path.exists(output_path + '.moving'):
+            os.remove(output_path + '.moving')
 
 
 # 使用示例